@@ -0,0 +1,359 @@
+from array import array
+from collections import defaultdict, deque
+from itertools import combinations
+
+from clustering import EDGE_SAMPLE, artifact_contributors, artifact_keywords
+from graph_encoding import CompactGraph
+
+
+## Bipartite artifact <-> key adjacency (key = file hash, keyword, ...) stored
+## as two CSR (offsets + indices) integer arrays so lookups are direct slices.
+## key_index maps key -> position; a dict is built when none is given.
+class Relation:
+    def __init__(self, keys, artifact_offsets, artifact_keys, key_offsets, key_artifacts, key_index=None):
+        self.keys = keys
+        self.key_index = {k: i for i, k in enumerate(keys)} if key_index is None else key_index
+        self.artifact_offsets = artifact_offsets
+        self.artifact_keys = artifact_keys
+        self.key_offsets = key_offsets
+        self.key_artifacts = key_artifacts
+
+    @classmethod
+    def from_lists(cls, artifact_key_lists):
+        ## artifact_key_lists[i] is the ordered list of key strings of artifact i
+        keys = []
+        key_index = {}
+        artifact_offsets = array('l', [0])
+        artifact_keys = array('l')
+        members = []
+        for i, artifact_key_list in enumerate(artifact_key_lists):
+            seen = set()
+            for key in artifact_key_list:
+                if key is None or key in seen:
+                    continue
+                seen.add(key)
+                k = key_index.get(key)
+                if k is None:
+                    k = key_index[key] = len(keys)
+                    keys.append(key)
+                    members.append([])
+                artifact_keys.append(k)
+                members[k].append(i)
+            artifact_offsets.append(len(artifact_keys))
+
+        key_offsets = array('l', [0])
+        key_artifacts = array('l')
+        for artifact_indices in members:
+            key_artifacts.extend(artifact_indices)
+            key_offsets.append(len(key_artifacts))
+        return cls(keys, artifact_offsets, artifact_keys, key_offsets, key_artifacts)
+
+    def keys_of(self, artifact):
+        return self.artifact_keys[self.artifact_offsets[artifact]:self.artifact_offsets[artifact + 1]]
+
+    def artifacts_of(self, key):
+        return self.key_artifacts[self.key_offsets[key]:self.key_offsets[key + 1]]
+
+    def shared_keys(self):
+        ## Yields (key, artifacts) for every key held by more than one artifact
+        for k in range(len(self.keys)):
+            start, end = self.key_offsets[k], self.key_offsets[k + 1]
+            if end - start > 1:
+                yield k, self.key_artifacts[start:end]
+
+    def neighbours(self, artifact):
+        ## Returns {other artifact: [shared key indices]} for one artifact
+        shared = {}
+        for k in self.keys_of(artifact):
+            for other in self.artifacts_of(k):
+                if other != artifact:
+                    shared.setdefault(other, []).append(k)
+        return shared
+
+
+## Resident graph of every osc_dataset artifact and the relations between them.
+## Artifacts are addressed by their row position; `index` maps artifact_id -> position.
+## The graph is built from the database here, or mapped from a published
+## snapshot file by graph_snapshot.py.
+class ArtifactGraph:
+    def __init__(self, artifact_ids, titles, relations, hash_files, index=None):
+        self.artifact_ids = artifact_ids
+        self.titles = titles
+        self.index = {a: i for i, a in enumerate(artifact_ids)} if index is None else index
+        self.relations = relations
+        ## hash_files[k] is the list of filenames seen for hash key k
+        self.hash_files = hash_files
+
+    @classmethod
+    def from_entries(cls, artifacts, entries, keywords=(), contributors=()):
+        ## artifacts are (artifact_id, title) rows, entries are (artifact_id, hash,
+        ## filename) manifest entries in manifest order, keywords and contributors
+        ## are (artifact_id, keyword) and (artifact_id, contributor) rows
+        artifact_ids = [artifact_id for artifact_id, _ in artifacts]
+        titles = ["No Title" if title is None else title for _, title in artifacts]
+        position = {artifact_id: i for i, artifact_id in enumerate(artifact_ids)}
+        manifest_hashes = [[] for _ in artifact_ids]
+        files = {}
+        for artifact_id, h, filename in entries:
+            i = position.get(artifact_id)
+            if i is None:
+                continue
+            manifest_hashes[i].append(h)
+            files.setdefault(h, set()).add(filename)
+
+        def key_lists(rows):
+            lists = [[] for _ in artifact_ids]
+            for artifact_id, key in rows:
+                i = position.get(artifact_id)
+                if i is not None:
+                    lists[i].append(key)
+            return lists
+
+        hash_relation = Relation.from_lists(manifest_hashes)
+        hash_files = [sorted(files[h], key=str) for h in hash_relation.keys]
+        relations = {
+            "hash": hash_relation,
+            "keyword": Relation.from_lists(key_lists(keywords)),
+            "contributor": Relation.from_lists(key_lists(contributors)),
+        }
+        return cls(artifact_ids, titles, relations, hash_files)
+
+    @classmethod
+    def from_records(cls, records):
+        ## records are (artifact_id, data) rows of osc_dataset
+        artifacts = []
+        entries = []
+        keywords = []
+        contributors = []
+        for artifact_id, data in records:
+            artifacts.append((artifact_id, data.get("mandatory_public_fields", {}).get("title", "No Title")))
+            for item in data.get("public_fields", {}).get("manifest", []) or []:
+                if item.get("hash") is not None:
+                    entries.append((artifact_id, item.get("hash"), item.get("filename")))
+            keywords.extend((artifact_id, keyword) for keyword in artifact_keywords(data))
+            contributors.extend((artifact_id, contributor) for contributor in artifact_contributors(data))
+        return cls.from_entries(artifacts, entries, keywords, contributors)
+
+    @classmethod
+    def load(cls, cur):
+        ## Reads the precomputed manifest_entries table; no manifest JSONB is parsed
+        cur.execute("SELECT artifact_id, data->'mandatory_public_fields'->>'title' FROM osc_dataset ORDER BY id;")
+        artifacts = cur.fetchall()
+        cur.execute("SELECT artifact_id, hash, filename FROM manifest_entries ORDER BY artifact_id, position;")
+        entries = cur.fetchall()
+        cur.execute("SELECT artifact_id, keyword FROM keyword_artifacts ORDER BY artifact_id, keyword;")
+        keywords = cur.fetchall()
+        cur.execute("SELECT artifact_id, contributor FROM contributor_artifacts ORDER BY artifact_id, contributor;")
+        return cls.from_entries(artifacts, entries, keywords, cur.fetchall())
+
+    def node(self, artifact):
+        hashes = self.relations["hash"]
+        keys = hashes.keys_of(artifact)
+        names = [hashes.keys[k] for k in keys]
+        return {
+            "artifact_id": self.artifact_ids[artifact],
+            "title": self.titles[artifact],
+            "hashes": names,
+            "hash_and_files": {name: self.hash_files[k] for name, k in zip(names, keys)},
+        }
+
+    def pair_edges(self, kind, artifact=None):
+        ## Yields (a, b, shared key indices) once per artifact pair sharing keys of
+        ## `kind`, or for every neighbour b of `artifact` when one is given
+        relation = self.relations[kind]
+        sources = range(len(self.artifact_ids)) if artifact is None else (artifact,)
+        for a in sources:
+            for b, shared in relation.neighbours(a).items():
+                if artifact is not None or a < b:
+                    yield a, b, shared
+
+    def hash_edges(self, artifact=None, aggregate=True):
+        ## (a, b, shared hash indices) per pair when aggregating, otherwise
+        ## (a, b, [k]) once per shared hash k as the manifest always had
+        hashes = self.relations["hash"]
+        if aggregate:
+            return self.pair_edges("hash", artifact)
+        if artifact is None:
+            return (
+                (a, b, [k])
+                for k, artifacts in hashes.shared_keys()
+                for a, b in combinations(artifacts, 2)
+            )
+        return ((artifact, other, [k]) for other, shared in hashes.neighbours(artifact).items() for k in shared)
+
+    def manifest(self, specific_artifact_id="all", aggregate=True):
+        ## Same payload as the /manifest/<id>/ endpoint: a list of nodes followed by
+        ## {"edges": [...]}. Edges are one per artifact pair with a weight and a
+        ## sample of the shared hashes, or with aggregate=False one per shared hash.
+        hashes = self.relations["hash"]
+        ids = self.artifact_ids
+
+        if specific_artifact_id == "all":
+            artifact = None
+            result = [self.node(i) for i in range(len(ids))]
+        else:
+            artifact = self.index.get(specific_artifact_id)
+            if artifact is None:
+                return [{"edges": []}]
+            result = [self.node(i) for i in sorted({artifact, *hashes.neighbours(artifact)})]
+
+        if aggregate:
+            edges = [
+                {"node1": ids[a], "node2": ids[b], "weight": len(shared), "shared": [hashes.keys[k] for k in shared[:EDGE_SAMPLE]]}
+                for a, b, shared in self.hash_edges(artifact)
+            ]
+        else:
+            edges = [
+                {"node1": ids[a], "node2": ids[b], "hash": hashes.keys[k]}
+                for a, b, (k,) in self.hash_edges(artifact, aggregate=False)
+            ]
+        result.append({"edges": edges})
+        return result
+
+    def compact_manifest(self, specific_artifact_id="all", aggregate=True):
+        ## The manifest() graph as a CompactGraph: node_data carries titles and each
+        ## node's hashes (key_offsets / keys), key_data the filenames of every hash.
+        ## Aggregated edges carry a weight column and their sampled hashes as keys.
+        hashes = self.relations["hash"]
+        ids = self.artifact_ids
+        graph = CompactGraph()
+
+        if specific_artifact_id == "all":
+            artifact = None
+            members = range(len(ids))
+        else:
+            artifact = self.index.get(specific_artifact_id)
+            if artifact is None:
+                return graph
+            members = sorted({artifact, *hashes.neighbours(artifact)})
+
+        ## positions[j] is the hash key index of graph key j; every edge key is a
+        ## key of one of its nodes, so the nodes register them all
+        positions = []
+
+        def key(k):
+            j = graph.key(hashes.keys[k])
+            if j == len(positions):
+                positions.append(k)
+            return j
+
+        titles = []
+        node_keys = array('l')
+        key_offsets = array('l', [0])
+        for i in members:
+            graph.node(ids[i])
+            titles.append(self.titles[i])
+            node_keys.extend(key(k) for k in hashes.keys_of(i))
+            key_offsets.append(len(node_keys))
+        if aggregate:
+            weights = graph.column("weight")
+            for a, b, shared in self.hash_edges(artifact):
+                graph.add_edge(ids[a], ids[b], [hashes.keys[k] for k in shared[:EDGE_SAMPLE]], multi=True)
+                weights.append(len(shared))
+        else:
+            for a, b, (k,) in self.hash_edges(artifact, aggregate=False):
+                graph.add_edge(ids[a], ids[b], hashes.keys[k])
+
+        graph.node_data = {"title": titles, "key_offsets": key_offsets, "keys": node_keys}
+        graph.key_data = {"files": [self.hash_files[k] for k in positions]}
+        return graph
+
+    def keyword_neighbourhood(self, artifact_id, max_depth, max_nodes, max_edges):
+        ## Breadth-first walk over shared keywords starting at artifact_id (depth 0).
+        ## Artifacts up to max_depth hops away are reached; edges are reported once
+        ## with the BFS depth of both ends. Returns (edges, truncated) where
+        ## truncated says the node or edge budget cut the walk short.
+        keywords = self.relations["keyword"]
+        ids = self.artifact_ids
+        start = self.index.get(artifact_id)
+        if start is None:
+            return [], False
+
+        depth = {start: 0}
+        queue = deque([start])
+        seen_edges = set()
+        edges = []
+        truncated = False
+        while queue:
+            artifact = queue.popleft()
+            if depth[artifact] >= max_depth:
+                continue
+            neighbours = keywords.neighbours(artifact)
+            for other in sorted(neighbours):
+                edge_key = (artifact, other) if artifact < other else (other, artifact)
+                if edge_key in seen_edges:
+                    continue
+                if len(edges) >= max_edges:
+                    return edges, True
+                if other not in depth:
+                    if len(depth) >= max_nodes:
+                        truncated = True
+                        continue
+                    depth[other] = depth[artifact] + 1
+                    queue.append(other)
+                seen_edges.add(edge_key)
+                edges.append({
+                    "node1": ids[artifact],
+                    "node2": ids[other],
+                    "weight": len(neighbours[other]),
+                    "shared_keywords": [keywords.keys[k] for k in neighbours[other]],
+                    "node1depth": depth[artifact],
+                    "node2depth": depth[other],
+                })
+        return edges, truncated
+
+    def neighbourhood(self, artifact_id, kinds, max_depth, fanout, max_nodes, max_edges):
+        ## Breadth-first walk from artifact_id (depth 0) over the relations in `kinds`.
+        ## An expanded artifact follows at most `fanout` neighbours, those sharing the
+        ## most keys over all kinds first (ties by artifact_id); the walk takes no
+        ## artifact past max_nodes and stops once it has max_edges edges.
+        ## Returns (nodes, edges, truncated), or None for an unknown artifact: nodes
+        ## are (artifact, depth) in visiting order, edges (position, a, b, kind,
+        ## shared key indices) once per pair and kind, ordered by `position`, the
+        ## index in nodes of the edge's later visited end. truncated says a
+        ## fan-out, node or edge limit left neighbours out.
+        start = self.index.get(artifact_id)
+        if start is None:
+            return None
+
+        position = {start: 0}
+        nodes = [(start, 0)]
+        edges = []
+        seen = set()
+        truncated = False
+        for artifact, depth in nodes:
+            if depth >= max_depth:
+                break
+            shared = {kind: self.relations[kind].neighbours(artifact) for kind in kinds}
+            weight = defaultdict(int)
+            for neighbours in shared.values():
+                for other, keys in neighbours.items():
+                    weight[other] += len(keys)
+            ranked = sorted(weight, key=lambda other: (-weight[other], self.artifact_ids[other]))
+            if len(ranked) > fanout:
+                ranked = ranked[:fanout]
+                truncated = True
+            for other in ranked:
+                if len(edges) >= max_edges:
+                    truncated = True
+                    break
+                if other not in position:
+                    if len(nodes) >= max_nodes:
+                        truncated = True
+                        continue
+                    position[other] = len(nodes)
+                    nodes.append((other, depth + 1))
+                for kind, neighbours in shared.items():
+                    keys = neighbours.get(other)
+                    pair = (min(artifact, other), max(artifact, other), kind)
+                    if keys and pair not in seen:
+                        if len(edges) >= max_edges:
+                            truncated = True
+                            break
+                        seen.add(pair)
+                        edges.append((max(position[artifact], position[other]), artifact, other, kind, keys))
+            if len(edges) >= max_edges:
+                truncated = True
+                break
+        edges.sort(key=lambda edge: edge[0])
+        return nodes, edges, truncated
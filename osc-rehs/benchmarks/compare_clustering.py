@@ -0,0 +1,63 @@
+## Times the original recursive cluster build against the bulk engine in
+## init_clusters.py on the current database and checks both give the same clusters.
+##
+##   cd osc-rehs && python -m benchmarks.compare_clustering
+##
+## Both builds write the real cluster tables; the bulk result is what is left behind.
+import contextlib
+import io
+import json
+import time
+
+import init_clusters
+
+
+def read_clusters(cur, kind):
+    ## {cluster name: set of undirected edges}, independent of row and edge order
+    table, name_column, _ = init_clusters.CLUSTER_KINDS[kind]
+    cur.execute(f"SELECT {name_column}, edges::text FROM {table};")
+    clusters = {}
+    for name, edges in cur.fetchall():
+        clusters[name] = {
+            tuple(sorted((edge["node1"].strip("{}"), edge["node2"].strip("{}"))))
+            for edge in json.loads(edges)
+        }
+    return clusters
+
+
+def legacy_build(conn, kind):
+    if kind == "hash":
+        init_clusters.legacy_rebuild_hash_clusters(conn)
+        return
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM keyword_clusters;")
+        cur.execute("SELECT artifact_id FROM osc_dataset")
+        all_artifact_ids = cur.fetchall()
+        ## init_keyword_cluster prints every visited node
+        with contextlib.redirect_stdout(io.StringIO()):
+            init_clusters.init_keyword_cluster(all_artifact_ids, cur)
+
+
+def timed(build):
+    start = time.perf_counter()
+    build()
+    return time.perf_counter() - start
+
+
+def main():
+    conn = init_clusters.conn = init_clusters.connect()
+    print(f"{'kind':<8} {'legacy s':>10} {'bulk s':>10} {'speedup':>8} {'clusters':>9}  same")
+    for kind in sorted(init_clusters.CLUSTER_KINDS):
+        legacy_seconds = timed(lambda: legacy_build(conn, kind))
+        with conn.cursor() as cur:
+            legacy = read_clusters(cur, kind)
+        bulk_seconds = timed(lambda: init_clusters.rebuild_clusters(conn, kind))
+        with conn.cursor() as cur:
+            bulk = read_clusters(cur, kind)
+        speedup = legacy_seconds / bulk_seconds if bulk_seconds else float("inf")
+        print(f"{kind:<8} {legacy_seconds:>10.3f} {bulk_seconds:>10.3f} {speedup:>7.1f}x {len(bulk):>9}  {legacy == bulk}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
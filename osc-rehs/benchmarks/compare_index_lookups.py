@@ -0,0 +1,118 @@
+## Compares the neighbour and edge lookups of manifest_backend.py against the old
+## comma-joined index tables (keyword_index, hash_index, contributor_index) and
+## the normalized (key, artifact_id) tables from sql/migrations/01_artifact_index_tables.sql.
+##
+##   cd osc-rehs && python -m benchmarks.compare_index_lookups [--repeat N]
+##
+## For every lookup it prints the mean time per query and the scans in the plan.
+import argparse
+import time
+
+import init_clusters
+
+## name -> (old query, new query, params(node1, node2) for old, params for new)
+LOOKUPS = {
+    "keyword neighbours": (
+        """
+        WITH artifact_keywords AS (
+            SELECT TRIM(keyword) AS keyword
+            FROM keyword_index, unnest(string_to_array(artifact_ids, ',')) AS aid
+            WHERE aid = %s
+        )
+        SELECT aid2, TRIM(ki.keyword)
+        FROM keyword_index ki
+        JOIN LATERAL unnest(string_to_array(ki.artifact_ids, ',')) AS aid2 ON TRUE
+        JOIN artifact_keywords ak ON TRIM(ki.keyword) = ak.keyword
+        WHERE aid2 != %s;
+        """,
+        """
+        SELECT other.artifact_id, other.keyword
+        FROM keyword_artifacts mine
+        JOIN keyword_artifacts other ON other.keyword = mine.keyword
+        WHERE mine.artifact_id = %s AND other.artifact_id != %s;
+        """,
+        lambda node1, node2: (node1, node1),
+        lambda node1, node2: (node1, node1),
+    ),
+    "keyword edge": (
+        "SELECT keyword FROM keyword_index WHERE artifact_ids LIKE %s AND artifact_ids LIKE %s;",
+        """
+        SELECT a.keyword FROM keyword_artifacts a
+        JOIN keyword_artifacts b ON b.keyword = a.keyword
+        WHERE a.artifact_id = %s AND b.artifact_id = %s;
+        """,
+        lambda node1, node2: (f"%{node1}%", f"%{node2}%"),
+        lambda node1, node2: (node1, node2),
+    ),
+    "hash edge": (
+        "SELECT hash FROM hash_index WHERE artifact_ids LIKE %s AND artifact_ids LIKE %s;",
+        """
+        SELECT a.hash FROM hash_artifacts a
+        JOIN hash_artifacts b ON b.hash = a.hash
+        WHERE a.artifact_id = %s AND b.artifact_id = %s;
+        """,
+        lambda node1, node2: (f"%{node1}%", f"%{node2}%"),
+        lambda node1, node2: (node1, node2),
+    ),
+    "contributor of artifact": (
+        "SELECT contributor FROM contributor_index WHERE artifact_ids LIKE %s;",
+        "SELECT contributor FROM contributor_artifacts WHERE artifact_id = %s;",
+        lambda node1, node2: (f"%{node1}%",),
+        lambda node1, node2: (node1,),
+    ),
+}
+
+
+def plan_scans(plan):
+    ## Flattens an EXPLAIN (FORMAT JSON) plan into 'Seq Scan on t' / 'Index Scan using i' strings
+    scans = []
+    node_type = plan["Node Type"]
+    if "Index Name" in plan:
+        scans.append(f"{node_type} using {plan['Index Name']}")
+    elif "Relation Name" in plan:
+        scans.append(f"{node_type} on {plan['Relation Name']}")
+    for child in plan.get("Plans", []):
+        scans.extend(plan_scans(child))
+    return scans
+
+
+def measure(cur, query, params_list, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for params in params_list:
+            cur.execute(query, params)
+            cur.fetchall()
+    seconds = (time.perf_counter() - start) / (repeat * len(params_list))
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params_list[0])
+    return seconds, plan_scans(cur.fetchone()[0][0]["Plan"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare old and normalized index lookups.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--pairs", type=int, default=50, help="number of sharing artifact pairs to look up")
+    args = parser.parse_args()
+
+    conn = init_clusters.connect()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT a.artifact_id, b.artifact_id FROM hash_artifacts a
+            JOIN hash_artifacts b ON b.hash = a.hash AND b.artifact_id > a.artifact_id
+            GROUP BY 1, 2 LIMIT %s;
+        """, (args.pairs,))
+        pairs = cur.fetchall()
+        if not pairs:
+            raise SystemExit("hash_artifacts is empty; run `python init_clusters.py --index-tables` first")
+
+        print(f"{'lookup':<24} {'old ms':>8} {'new ms':>8} {'speedup':>8}")
+        for name, (old_query, new_query, old_params, new_params) in LOOKUPS.items():
+            old_seconds, old_scans = measure(cur, old_query, [old_params(*p) for p in pairs], args.repeat)
+            new_seconds, new_scans = measure(cur, new_query, [new_params(*p) for p in pairs], args.repeat)
+            print(f"{name:<24} {old_seconds * 1000:>8.3f} {new_seconds * 1000:>8.3f} {old_seconds / new_seconds:>7.1f}x")
+            print(f"    old: {', '.join(old_scans)}")
+            print(f"    new: {', '.join(new_scans)}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
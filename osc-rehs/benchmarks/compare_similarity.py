@@ -0,0 +1,99 @@
+## Benchmarks the MinHash/LSH similarity index of similarity.py on synthetic
+## corpora: artifacts with random manifest hash sets, a share of which are
+## planted near-duplicates (a copy of another artifact with a few hashes swapped).
+##
+##   cd osc-rehs && python -m benchmarks.compare_similarity [--sizes 10000 100000 1000000]
+##
+## For every corpus size it prints the index build time, the mean LSH query time
+## next to a brute-force scan of every artifact, and the recall of the planted
+## near-duplicates at the threshold. The brute-force scan is skipped above
+## --brute-max artifacts.
+import argparse
+import time
+
+import numpy as np
+
+from similarity import MinHashIndex
+
+
+def synthetic_corpus(n, mean_keys, universe, duplicate_share, mutation, rng):
+    ## Returns (offsets, tokens, planted) where planted holds (copy, original) pairs
+    sizes = rng.poisson(mean_keys - 1, n) + 1
+    sets = [rng.choice(universe, size, replace=False) for size in sizes]
+    planted = []
+    for copy in rng.choice(n, int(n * duplicate_share), replace=False):
+        original = int(rng.integers(n))
+        if original == copy:
+            continue
+        keys = sets[original].copy()
+        swap = rng.random(len(keys)) < mutation
+        keys[swap] = rng.integers(universe, universe * 2, int(swap.sum()))
+        sets[copy] = np.unique(keys)
+        planted.append((int(copy), original))
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(keys) for keys in sets])
+    return offsets, np.concatenate(sets).astype(np.int64), planted
+
+
+def brute_force_similar(offsets, tokens, artifact, threshold):
+    keys = set(tokens[offsets[artifact]:offsets[artifact + 1]].tolist())
+    results = []
+    for other in range(len(offsets) - 1):
+        if other == artifact:
+            continue
+        other_keys = set(tokens[offsets[other]:offsets[other + 1]].tolist())
+        shared = len(keys & other_keys)
+        if shared and shared / (len(keys) + len(other_keys) - shared) >= threshold:
+            results.append(other)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MinHash/LSH similarity index.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--mean-keys", type=int, default=10, help="mean manifest hashes per artifact")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--brute-max", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'artifacts':>10} {'build s':>8} {'lsh ms':>8} {'brute ms':>9} {'speedup':>8} {'recall':>7}")
+    for n in args.sizes:
+        rng = np.random.default_rng(args.seed)
+        offsets, tokens, planted = synthetic_corpus(
+            n, args.mean_keys, universe=n * args.mean_keys, duplicate_share=0.05, mutation=0.1, rng=rng)
+
+        start = time.perf_counter()
+        index = MinHashIndex(offsets, tokens, num_perm=args.num_perm, bands=args.bands, seed=args.seed)
+        build_seconds = time.perf_counter() - start
+
+        queries = [copy for copy, _ in planted[:args.queries]]
+        start = time.perf_counter()
+        found = [index.similar(copy, args.threshold) for copy in queries]
+        lsh_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+        ## Recall over planted pairs that really are above the threshold
+        hits = total = 0
+        for (copy, original), similar in zip(planted, found):
+            keys = np.unique(index.keys_of(copy))
+            if index.jaccard(keys, original) >= args.threshold:
+                total += 1
+                hits += any(other == original for other, _ in similar)
+        recall = hits / total if total else 1.0
+
+        if n <= args.brute_max:
+            brute_queries = queries[:max(1, min(len(queries), 2000000 // n))]
+            start = time.perf_counter()
+            for copy in brute_queries:
+                brute_force_similar(offsets, tokens, copy, args.threshold)
+            brute_ms = (time.perf_counter() - start) / len(brute_queries) * 1000
+            print(f"{n:>10} {build_seconds:>8.2f} {lsh_ms:>8.3f} {brute_ms:>9.1f} {brute_ms / lsh_ms:>7.0f}x {recall:>7.3f}")
+        else:
+            print(f"{n:>10} {build_seconds:>8.2f} {lsh_ms:>8.3f} {'-':>9} {'-':>8} {recall:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
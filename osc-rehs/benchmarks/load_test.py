@@ -0,0 +1,137 @@
+## Load test for a running manifest_backend.py. Replays a mix of backend requests
+## at increasing concurrency and prints throughput and latency percentiles.
+##
+##   cd osc-rehs && python manifest_backend.py --production &
+##   python -m benchmarks.load_test --url http://127.0.0.1:5000 --concurrency 1 4 16 64
+##
+## Artifact ids, hashes and edges for the requests are sampled from the local
+## database, so the database and the backend should hold the same data. With
+## --json the report also holds the backend's /metrics (per-endpoint SQL, graph
+## and serialization time and query counts) as of the end of the run.
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import init_clusters
+
+
+def sample_paths(cur, count):
+    ## A mix of cached reads (manifest, artifact) and per-request queries
+    ## (edges, contributor neighbours, file hashes) so both paths are loaded
+    cur.execute("SELECT artifact_id FROM osc_dataset ORDER BY random() LIMIT %s;", (count,))
+    artifacts = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT node1, node2, hash FROM hash_edges ORDER BY random() LIMIT %s;", (count,))
+    edges = cur.fetchall()
+    if not artifacts:
+        raise SystemExit("osc_dataset is empty")
+
+    quote = lambda value: urllib.parse.quote(value, safe="")
+    paths = []
+    for artifact_id in artifacts:
+        paths.append(f"/manifest/{quote(artifact_id)}/")
+        paths.append(f"/artifact/{quote(artifact_id)}/")
+        paths.append(f"/artifact/contributor/{quote(artifact_id)}/")
+    for node1, node2, h in edges:
+        paths.append(f"/edge/{quote(node1)}/{quote(node2)}/hash")
+        paths.append(f"/edge/{quote(node1)}/{quote(node2)}/keyword")
+        paths.append(f"/filehash/{quote(h)}/")
+    paths.append("/cluster/contributor?sort=count&limit=50")
+    return paths
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_level(url, paths, concurrency, duration):
+    ## Runs `concurrency` client threads for `duration` seconds; each thread issues
+    ## requests back to back. Returns the summary dict for this level.
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        own_latencies = []
+        own_errors = 0
+        while time.perf_counter() < deadline:
+            path = rng.choice(paths)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url + path, timeout=60) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                ## 404s are answers, not failures (e.g. a pair without a keyword edge)
+                if e.code >= 500:
+                    own_errors += 1
+            except OSError:
+                own_errors += 1
+            own_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running manifest backend.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--sample", type=int, default=50, help="artifacts and edges to sample for requests")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    conn = init_clusters.connect()
+    with conn.cursor() as cur:
+        paths = sample_paths(cur, args.sample)
+    conn.close()
+
+    results = []
+    print(f"{'clients':>7} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        result = run_level(args.url.rstrip("/"), paths, concurrency, args.duration)
+        results.append(result)
+        print(f"{result['concurrency']:>7} {result['requests']:>9} {result['errors']:>7} "
+              f"{result['requests_per_second']:>9.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+    if args.json:
+        report = {"url": args.url, "duration": args.duration, "results": results}
+        try:
+            with urllib.request.urlopen(args.url.rstrip("/") + "/metrics?format=json", timeout=60) as response:
+                report["metrics"] = json.load(response)
+        except (OSError, ValueError):
+            pass
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
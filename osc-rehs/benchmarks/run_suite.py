@@ -0,0 +1,417 @@
+## Reproducible benchmark suite. For every corpus size it generates synthetic
+## osc_dataset rows (benchmarks/synthetic_dataset.py), loads them into a scratch
+## database, rebuilds the derived tables while timing each clustering stage, and
+## then drives every backend endpoint in-process through the Flask test client.
+##
+##   cd osc-rehs && python -m benchmarks.run_suite [--sizes 1000 10000 100000] [--output report.json]
+##   python -m benchmarks.run_suite --report new.json --compare old.json
+##
+## The report is JSON (format "osc-benchmark/1") with the machine, commit and
+## parameters next to the results, so runs can be compared release to release
+## with --compare. The scratch database (--database, default osc_bench) is
+## created from sql/init and sql/migrations when missing and emptied for every
+## size; it must not be the database the portal uses.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+import psycopg2
+
+import cluster_pipeline
+import graph_snapshot
+import init_clusters
+from benchmarks import compare_clustering
+from benchmarks.synthetic_dataset import DEFAULTS, generate
+
+REPORT_FORMAT = "osc-benchmark/1"
+DUMP = os.path.join(os.path.dirname(init_clusters.MIGRATIONS), "init", "00_OSC_Portal_dump.sql")
+## Tables emptied before every size; derived tables are rebuilt by the stages
+RESET_TABLES = (
+    "osc_dataset", "manifest_entries", "hash_artifacts", "keyword_artifacts", "contributor_artifacts",
+    "contributor_summary", "hash_clusters", "keyword_clusters", "cluster_state", "cluster_sync",
+    "cluster_lod_nodes", "cluster_lod_edges", "hash_index", "keyword_index", "contributor_index", "logs",
+)
+## The recursive legacy builds need one Python frame per artifact of a cluster
+LEGACY_STACK_BYTES = 512 * 1024 * 1024
+
+
+#region Database
+def connect_to(dbname):
+    return psycopg2.connect(host="localhost", port=5432, dbname=dbname,
+                            user=os.getenv('DB_USERNAME'), password=os.getenv('DB_PASSWORD'))
+
+def prepare_database(name):
+    ## Creates the scratch database with the portal schema and migrations when missing
+    admin = connect_to("postgres")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (name,))
+        if cur.fetchone() is None:
+            cur.execute(f'CREATE DATABASE "{name}";')
+    admin.close()
+
+    conn = connect_to(name)
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.osc_dataset'), current_setting('server_version_num')::int;")
+        exists, server_version = cur.fetchone()
+        if exists is None:
+            with open(DUMP) as f:
+                schema = f.read()
+            ## pg_dump 17 emits settings older servers reject
+            if server_version < 170000:
+                schema = re.sub(r"^SET transaction_timeout = .*$", "", schema, flags=re.M)
+            cur.execute(schema)
+    conn.commit()
+    conn.close()
+
+    ## A fresh session: the dump clears search_path
+    conn = connect_to(name)
+    with conn.cursor() as cur:
+        init_clusters.ensure_cluster_state(cur)
+        ## The comma-joined index tables generating_hash_index and the legacy builds write
+        for table, key_column in (("hash_index", "hash"), ("keyword_index", "keyword"), ("contributor_index", "contributor")):
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key_column} text, artifact_ids text);")
+    conn.commit()
+    ## The legacy builds commit through init_clusters' module-level connection
+    init_clusters.conn = conn
+    return conn
+
+def load_corpus(conn, n, seed, params):
+    ## Replaces osc_dataset with n synthetic rows; manifest_entries and
+    ## ts_vector follow through the osc_dataset triggers
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY CASCADE;")
+        cluster_pipeline.copy_rows(cur, "osc_dataset", ("artifact_id", "data"), (
+            (artifact_id, json.dumps(data)) for artifact_id, data in generate(n, seed, **params)
+        ))
+    conn.commit()
+
+def corpus_stats(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT (SELECT count(*) FROM osc_dataset), (SELECT count(*) FROM manifest_entries),
+                   (SELECT count(*) FROM hash_edges), (SELECT count(*) FROM keyword_artifacts),
+                   (SELECT count(*) FROM contributor_summary),
+                   (SELECT count(*) FROM hash_clusters), (SELECT coalesce(max(edge_count), 0) FROM hash_clusters),
+                   (SELECT count(*) FROM keyword_clusters), (SELECT coalesce(max(edge_count), 0) FROM keyword_clusters);
+        """)
+        names = ("artifacts", "manifest_entries", "hash_edges", "keyword_rows", "contributors",
+                 "hash_clusters", "largest_hash_cluster_edges", "keyword_clusters", "largest_keyword_cluster_edges")
+        return dict(zip(names, cur.fetchone()))
+#endregion
+
+#region Clustering stages
+def in_big_stack(function):
+    ## Runs function in a thread with a deep stack and recursion limit
+    result = {}
+
+    def run():
+        try:
+            function()
+        except BaseException as e:
+            result["error"] = e
+
+    limit = sys.getrecursionlimit()
+    size = threading.stack_size(LEGACY_STACK_BYTES)
+    sys.setrecursionlimit(10 ** 6)
+    try:
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(size)
+        sys.setrecursionlimit(limit)
+    if "error" in result:
+        raise result["error"]
+
+def generating_hash_index(conn):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM hash_index;")
+        init_clusters.generating_hash_index(cur)
+
+def incremental_update(conn, share):
+    ## Adds a new file to `share` of the artifacts and folds them in with
+    ## update_clusters (a touched row whose keys did not change is skipped)
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE osc_dataset SET updated_at = now(), data = jsonb_set(data, '{public_fields,manifest}',
+                COALESCE(data->'public_fields'->'manifest', '[]'::jsonb)
+                || jsonb_build_array(jsonb_build_object('hash', md5(artifact_id || now()::text), 'filename', 'touched.txt', 'algorithm', 'md5')))
+            WHERE id %% %s = 0;
+        """, (max(1, round(1 / share)),))
+    conn.commit()
+    init_clusters.update_clusters(conn, "hash")
+
+def clustering_stages(conn, n, legacy_max, workers, chunk_size, snapshot):
+    ## name -> callable, in run order; None marks a stage skipped at this size
+    legacy = n <= legacy_max
+    return [
+        ("index_tables", lambda: init_clusters.build_index_tables(conn)),
+        ("hash_edges", lambda: init_clusters.refresh_hash_edges(conn)),
+        ("generating_hash_index", lambda: generating_hash_index(conn)),
+        ("legacy_hash_clusters", legacy and (lambda: in_big_stack(lambda: init_clusters.legacy_rebuild_hash_clusters(conn)))),
+        ("legacy_keyword_clusters", legacy and (lambda: in_big_stack(lambda: compare_clustering.legacy_build(conn, "keyword")))),
+        ("rebuild_hash_clusters", lambda: init_clusters.rebuild_clusters(conn, "hash")),
+        ("rebuild_keyword_clusters", lambda: init_clusters.rebuild_clusters(conn, "keyword")),
+        ("incremental_hash_full", lambda: init_clusters.update_clusters(conn, "hash")),
+        ("incremental_hash_1pct", lambda: incremental_update(conn, 0.01)),
+        ("pipeline", lambda: cluster_pipeline.run_pipeline(list(cluster_pipeline.PIPELINE_KINDS), workers, chunk_size)),
+        ("graph_snapshot", lambda: init_clusters.publish_snapshot(conn, snapshot)),
+    ]
+
+def run_stages(conn, stages):
+    results = {}
+    for name, stage in stages:
+        if not stage:
+            results[name] = {"skipped": "above --legacy-max"}
+            print(f"  {name:<26} skipped", flush=True)
+            continue
+        start = time.perf_counter()
+        try:
+            ## The legacy builds print every visited artifact
+            with contextlib.redirect_stdout(io.StringIO()):
+                output = stage()
+            results[name] = {"seconds": time.perf_counter() - start}
+            if name == "pipeline":
+                results[name]["stages"] = output
+        except Exception as e:
+            conn.rollback()
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        print(f"  {name:<26} {results[name].get('seconds', float('nan')):>9.3f} s  {results[name].get('error', '')}", flush=True)
+    return results
+#endregion
+
+#region Endpoints
+def sample_requests(cur, seed, count):
+    ## name -> (list of (method, path, json body), requests to make). Parameters
+    ## are chosen with a seeded hash order, so every run asks the same questions.
+    def sample(query, params=()):
+        cur.execute(query, params)
+        return [row if len(row) > 1 else row[0] for row in cur.fetchall()]
+
+    params = (str(seed), count)
+    artifacts = sample("SELECT artifact_id FROM osc_dataset ORDER BY md5(%s || artifact_id) LIMIT %s;", params)
+    hash_pairs = sample("SELECT node1, node2 FROM hash_edges ORDER BY md5(%s || node1 || node2 || hash) LIMIT %s;", params)
+    keyword_pairs = sample("""
+        SELECT a.artifact_id, b.artifact_id FROM keyword_artifacts a
+        JOIN keyword_artifacts b ON b.keyword = a.keyword AND b.artifact_id > a.artifact_id
+        ORDER BY md5(%s || a.keyword || a.artifact_id || b.artifact_id) LIMIT %s;
+    """, params)
+    hashes = sample("SELECT hash FROM (SELECT DISTINCT hash FROM manifest_entries) h ORDER BY md5(%s || hash) LIMIT %s;", params)
+    hash_clusters = sample("SELECT cluster_hashes FROM hash_clusters ORDER BY md5(%s || component) LIMIT %s;", params)
+    keyword_clusters = sample("SELECT cluster_name FROM keyword_clusters ORDER BY md5(%s || component) LIMIT %s;", params)
+    contributors = sample("SELECT contributor FROM contributor_summary ORDER BY md5(%s || contributor) LIMIT %s;", params)
+    top_contributors = sample("SELECT contributor FROM contributor_summary ORDER BY num_artifacts DESC, contributor LIMIT %s;", (count,))
+    words = sample("""
+        SELECT word FROM (
+            SELECT DISTINCT unnest(string_to_array(data#>>'{mandatory_public_fields,title}', ' ')) AS word FROM osc_dataset
+        ) w
+        WHERE word ~ '^[A-Za-z]{3,}$' ORDER BY md5(%s || word) LIMIT %s;
+    """, params)
+
+    quote = lambda value: urllib.parse.quote(value, safe="")
+    get = lambda paths: [("GET", path, None) for path in paths]
+    return {
+        "manifest": (get(f"/manifest/{quote(a)}/" for a in artifacts), count),
+        "manifest_all": (get(["/manifest/all/"]), 3),
+        "manifest_all_compact": (get(["/manifest/all/?format=compact"]), 3),
+        "export_stream_page": (get(["/manifest/all/stream?limit=1000"]), 3),
+        "artifact": (get(f"/artifact/{quote(a)}/" for a in artifacts), count),
+        "artifact_keywords": (get(f"/artifact/keywords/{quote(a)}/" for a in artifacts), count),
+        "artifact_contributor": (get(f"/artifact/contributor/{quote(a)}/" for a in artifacts), count),
+        "neighbourhood": (get(f"/neighbourhood/{quote(a)}/?depth=2" for a in artifacts), count),
+        "contributor_names": (get(["/cluster/contributor?sort=count&limit=50"]), count),
+        "contributor_cluster": (get(f"/cluster/contributor/{quote(c)}" for c in contributors), count),
+        "contributor_cluster_top": (get(f"/cluster/contributor/{quote(c)}" for c in top_contributors), count),
+        "contributor_cluster_star": (get(f"/cluster/contributor/{quote(c)}?form=star" for c in top_contributors), count),
+        "keyword_cluster_names": (get(["/cluster/keywords"]), 3),
+        "hash_cluster_names": (get(["/cluster/hashes/"]), 3),
+        "hash_cluster": (get(f"/cluster/hashes/{quote(c)}" for c in hash_clusters), count),
+        "hash_cluster_lod": (get(f"/cluster/hashes/{quote(c)}?budget=100" for c in hash_clusters), count),
+        "keyword_cluster": (get(f"/cluster/keywords/{quote(c)}" for c in keyword_clusters), count),
+        "keyword_cluster_groups": (get(f"/cluster/keywords/{quote(c)}?form=group" for c in keyword_clusters), count),
+        "edge_hash": (get(f"/edge/{quote(a)}/{quote(b)}/hash" for a, b in hash_pairs), count),
+        "edge_keyword": (get(f"/edge/{quote(a)}/{quote(b)}/keyword" for a, b in keyword_pairs), count),
+        "filehash": (get(f"/filehash/{h}/" for h in hashes), count),
+        "search": (get(f"/search?q={quote(w)}" for w in words), count),
+        "similar": (get(f"/similar/{quote(a)}/" for a in artifacts), count),
+        "batch_artifacts": ([("POST", "/artifacts", {"ids": artifacts})], 3),
+    }
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def drive_endpoints(backend, requests):
+    from instrumentation import RequestMetrics
+
+    client = backend.app.test_client()
+    results = {}
+    for name, (calls, count) in requests.items():
+        if not calls:
+            results[name] = {"skipped": "no parameters in this corpus"}
+            continue
+        backend.request_metrics = RequestMetrics()
+        latencies = []
+        errors = 0
+        for i in range(count):
+            method, path, body = calls[i % len(calls)]
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 500
+        server = backend.request_metrics.to_dict()["endpoints"]
+        queries = sum(e["queries"]["sum"] for e in server.values())
+        spans = {span: sum(e["spans"][span]["sum"] for e in server.values()) for span in ("sql", "graph", "serialize")}
+        latencies.sort()
+        results[name] = {
+            "requests": count,
+            "errors": errors,
+            "mean_ms": sum(latencies) / count * 1000,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "max_ms": latencies[-1] * 1000,
+            "queries_per_request": queries / count,
+            **{f"{span}_ms": seconds / count * 1000 for span, seconds in spans.items()},
+        }
+        r = results[name]
+        print(f"  {name:<26} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} ms  {r['queries_per_request']:>6.1f} q  {errors} errors", flush=True)
+    return results
+
+def warm_backend(backend, snapshot):
+    ## Picks up the newly loaded corpus and times the resident structures it builds
+    backend.data_version_checked = float('-inf')
+    backend.current_data_version()
+    timings = {}
+    start = time.perf_counter()
+    graph_snapshot.open_snapshot(snapshot)
+    timings["snapshot_open"] = {"seconds": time.perf_counter() - start}
+    start = time.perf_counter()
+    backend.refresh_artifact_graph()
+    timings["artifact_graph"] = {"seconds": time.perf_counter() - start}
+    if backend.MinHashIndex is not None:
+        start = time.perf_counter()
+        backend.get_similarity_index()
+        timings["similarity_index"] = {"seconds": time.perf_counter() - start}
+    return timings
+#endregion
+
+#region Reports
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare_reports(baseline, current):
+    ## Prints current / baseline for every stage and endpoint p50 both reports have
+    print(f"{'size':>8} {'measure':<40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    old_sizes = {size["artifacts"]: size for size in baseline["sizes"]}
+    for size in current["sizes"]:
+        old = old_sizes.get(size["artifacts"])
+        if old is None:
+            continue
+        rows = []
+        for name, stage in size["stages"].items():
+            before = old["stages"].get(name, {}).get("seconds")
+            if before and "seconds" in stage:
+                rows.append((f"stage {name} s", before, stage["seconds"]))
+        for name, endpoint in size["endpoints"].items():
+            before = old["endpoints"].get(name, {}).get("p50_ms")
+            if before and "p50_ms" in endpoint:
+                rows.append((f"endpoint {name} p50 ms", before, endpoint["p50_ms"]))
+        for measure, before, after in rows:
+            print(f"{size['artifacts']:>8} {measure:<40} {before:>10.3f} {after:>10.3f} {after / before:>6.2f}x")
+#endregion
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark clustering and the backend on synthetic OSC corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", default="osc_bench", help="scratch database, emptied for every size")
+    parser.add_argument("--requests", type=int, default=30, help="requests per endpoint")
+    parser.add_argument("--legacy-max", type=int, default=10000, help="largest size the recursive legacy builds run at")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="cluster_pipeline extract processes")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default, help="synthetic corpus parameter")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--serve-snapshot", action="store_true",
+                        help="serve the endpoints from the mapped graph snapshot instead of a built graph")
+    parser.add_argument("--report", help="compare this existing report instead of running")
+    parser.add_argument("--compare", help="baseline report to compare against")
+    args = parser.parse_args()
+
+    if args.report:
+        with open(args.report) as f:
+            report = json.load(f)
+    else:
+        if args.database == os.getenv('DB_DATABASE', 'osc_portal'):
+            raise SystemExit(f"--database {args.database} is the portal database; use a scratch database")
+        params = {name: getattr(args, name) for name in DEFAULTS}
+        conn = prepare_database(args.database)
+
+        ## The backend reads these at import: the scratch database, and no response
+        ## cache so every request does its full work
+        os.environ['DB_DATABASE'] = args.database
+        os.environ['RESPONSE_CACHE_MAX_ENTRIES'] = '0'
+        os.environ['REQUEST_LOG_SAMPLE'] = '0'
+        os.environ['REQUEST_LOG_SLOW_MS'] = '0'
+        snapshot = os.path.join(tempfile.gettempdir(), f"{args.database}.graph")
+        if args.serve_snapshot:
+            os.environ['GRAPH_SNAPSHOT'] = snapshot
+        import manifest_backend as backend
+
+        with conn.cursor() as cur:
+            cur.execute("SHOW server_version;")
+            server_version = cur.fetchone()[0]
+        report = {
+            "format": REPORT_FORMAT,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "postgres": server_version},
+            "parameters": {"seed": args.seed, "requests": args.requests, "legacy_max": args.legacy_max,
+                           "workers": args.workers, "chunk_size": args.chunk_size, "serve_snapshot": args.serve_snapshot,
+                           "corpus": params},
+            "sizes": [],
+        }
+        for n in args.sizes:
+            print(f"{n} artifacts", flush=True)
+            start = time.perf_counter()
+            load_corpus(conn, n, args.seed, params)
+            stages = {"load_corpus": {"seconds": time.perf_counter() - start}}
+            print(f"  {'load_corpus':<26} {stages['load_corpus']['seconds']:>9.3f} s", flush=True)
+            stages.update(run_stages(conn, clustering_stages(conn, n, args.legacy_max, args.workers, args.chunk_size, snapshot)))
+            stages.update(warm_backend(backend, snapshot))
+            with conn.cursor() as cur:
+                requests = sample_requests(cur, args.seed, args.requests)
+            conn.commit()
+            print(f"  {'endpoint':<26} {'p50 ms':>9} {'p95 ms':>9}", flush=True)
+            endpoints = drive_endpoints(backend, requests)
+            report["sizes"].append({"artifacts": n, "corpus": corpus_stats(conn), "stages": stages, "endpoints": endpoints})
+            ## Written after every size so a long run leaves partial results
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        conn.close()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_reports(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
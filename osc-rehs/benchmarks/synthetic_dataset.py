@@ -0,0 +1,148 @@
+## Synthetic osc_dataset rows shaped like the real ones (see sql/init), for
+## benchmarking at sizes the bundled dump cannot reach. The same seed and
+## parameters always give the same rows.
+##
+## What overlaps between artifacts, and how much, is controlled by:
+##   overlap        share of manifest entries drawn from a pool of shared files
+##                  (LICENSE, shared inputs, ...); the rest are unique to the artifact
+##   mean_share     average number of artifacts holding one shared file
+##   fork_share     share of artifacts that copy the manifest of an earlier one
+##                  and change `fork_mutation` of its entries (near-duplicates)
+##   max_key_share  most artifacts that may hold one keyword or shared file; the
+##                  pair edges of a key grow with the square of its artifacts
+## Keywords and contributors follow Zipf distributions, manifest sizes a log-normal.
+import hashlib
+import math
+import random
+import uuid
+from bisect import bisect_left
+from itertools import accumulate
+
+DEFAULTS = {
+    "overlap": 0.2,
+    "mean_share": 3.0,
+    "fork_share": 0.05,
+    "fork_mutation": 0.1,
+    "max_key_share": 100,
+    "median_files": 8,
+    "max_files": 2000,
+    "empty_manifest_share": 0.05,
+    "zipf": 1.1,
+}
+
+TOPICS = (
+    "HPC", "neuroscience", "climate", "machine learning", "genomics", "workflow",
+    "visualization", "simulation", "data", "python", "MPI", "GPU", "earthquake",
+    "lidar", "provenance", "teaching", "tutorial", "parallel I/O", "WRF", "Lustre",
+    "materials science", "model", "gateway", "benchmark", "imaging",
+)
+WORDS = (
+    "analysis", "pipeline", "dataset", "notebook", "results", "training", "model",
+    "benchmark", "input", "output", "scripts", "cluster", "survey", "archive",
+)
+EXTENSIONS = ("py", "ipynb", "csv", "nc", "h5", "md", "txt", "json", "png", "pdf", "sh", "c")
+FORK_SOURCES = 1000
+COMMON_FILES = ("LICENSE", "README.md", ".gitignore", "requirements.txt", "Makefile", "environment.yml")
+
+
+def zipf_cum_weights(count, exponent):
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+class CappedZipf:
+    ## Zipf draws over range(count) where no value is handed out more than `cap`
+    ## times; a capped value is replaced by a uniform draw among the rest
+    def __init__(self, rng, count, exponent, cap):
+        self.rng = rng
+        self.count = count
+        self.cum_weights = zipf_cum_weights(count, exponent)
+        self.cap = cap
+        self.used = [0] * count
+
+    def draw(self):
+        total = self.cum_weights[-1]
+        value = bisect_left(self.cum_weights, self.rng.random() * total)
+        for _ in range(8):
+            if self.used[value] < self.cap:
+                break
+            value = self.rng.randrange(self.count)
+        self.used[value] += 1
+        return value
+
+
+def file_hash(*parts):
+    return hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def generate(n, seed=1, **params):
+    ## Yields (artifact_id, data) for n artifacts
+    params = {**DEFAULTS, **params}
+    rng = random.Random(seed)
+    mu = math.log(params["median_files"])
+
+    contributors = [f"user{i}@example.org" for i in range(max(20, n // 15))]
+    contributor_draws = CappedZipf(rng, len(contributors), params["zipf"], n)
+    vocabulary = list(TOPICS) + [f"topic {i}" for i in range(max(100, n // 8) - len(TOPICS))]
+    keyword_draws = CappedZipf(rng, len(vocabulary), params["zipf"], params["max_key_share"])
+
+    ## Expected shared entries over the corpus, spread so each file has mean_share holders
+    expected_files = n * math.exp(mu + 0.72)
+    pool_size = max(1, int(expected_files * params["overlap"] / params["mean_share"]))
+    pool_used = {}
+
+    def shared_entry():
+        for _ in range(8):
+            index = rng.randrange(pool_size)
+            if pool_used.get(index, 0) < params["max_key_share"]:
+                break
+        pool_used[index] = pool_used.get(index, 0) + 1
+        name = COMMON_FILES[index % len(COMMON_FILES)] if index < 64 else f"shared/input-{index}.{EXTENSIONS[index % len(EXTENSIONS)]}"
+        return {"hash": file_hash(seed, "shared", index), "filename": name, "algorithm": "sha256"}
+
+    ## Forks copy one of up to FORK_SOURCES earlier manifests (a reservoir sample)
+    sources = []
+    for i in range(n):
+        artifact_id = f"osc-is-artifact-{uuid.UUID(int=rng.getrandbits(128), version=4)}"
+        project = f"/home/{contributors[i % len(contributors)].split('@')[0]}/{rng.choice(WORDS)}-{i}"
+
+        if sources and rng.random() < params["fork_share"]:
+            manifest = []
+            for entry in sources[rng.randrange(len(sources))]:
+                if rng.random() < params["fork_mutation"]:
+                    entry = {**entry, "hash": file_hash(seed, artifact_id, len(manifest))}
+                manifest.append(entry)
+        elif rng.random() < params["empty_manifest_share"]:
+            manifest = []
+        else:
+            files = min(params["max_files"], max(1, int(rng.lognormvariate(mu, 1.2))))
+            manifest = []
+            for position in range(files):
+                if rng.random() < params["overlap"]:
+                    manifest.append(shared_entry())
+                else:
+                    name = f"{project}/{rng.choice(WORDS)}/{rng.choice(WORDS)}_{position}.{rng.choice(EXTENSIONS)}"
+                    manifest.append({"hash": file_hash(seed, artifact_id, position), "filename": name, "algorithm": "sha256"})
+        if len(sources) < FORK_SOURCES:
+            sources.append(manifest)
+        elif rng.randrange(i + 1) < FORK_SOURCES:
+            sources[rng.randrange(FORK_SOURCES)] = manifest
+
+        keywords = sorted({vocabulary[keyword_draws.draw()] for _ in range(rng.choices(range(6), (35, 15, 20, 15, 10, 5))[0])})
+        ## Real rows separate keywords inconsistently ("teaching,    HPC")
+        separator = rng.choice((", ", ",", ",    "))
+        title_words = keywords[:2] or [rng.choice(WORDS)]
+        yield artifact_id, {
+            "public_fields": {
+                "doi": f"10.5555/synthetic.{i}" if rng.random() < 0.3 else "",
+                "url": f"https://example.org/{i}" if rng.random() < 0.5 else "",
+                "keywords": separator.join(keywords),
+                "manifest": manifest,
+                "contributor": contributors[contributor_draws.draw()],
+            },
+            "private_fields": {},
+            "mandatory_public_fields": {
+                "title": f"{' '.join(title_words).title()} {rng.choice(WORDS)} {i}",
+                "description": " ".join(rng.choice(WORDS) for _ in range(rng.randrange(4, 20))),
+                "submission_comment": "Dataset submission to OSC Portal",
+            },
+        }
@@ -0,0 +1,352 @@
+## Batch pipeline rebuilding the cluster tables of one or more kinds (hash,
+## keyword, contributor) from osc_dataset:
+##
+##   extract     osc_dataset is cut into id ranges of --chunk-size rows, which a
+##               process pool reads and parses
+##   index       the same workers turn each row into the keys of every kind
+##               (file hashes, keywords, contributor)
+##   components  connected components (clustering.build_clusters) and their
+##               level-of-detail hierarchy, in this process
+##   load        rows are COPY'd into staging tables that replace the live tables
+##               in one transaction per kind
+##   snapshot    with --snapshot, the artifact graph snapshot the backend workers
+##               map is published last (graph_snapshot.py)
+##
+##   cd osc-rehs && python cluster_pipeline.py [--kind hash --kind keyword] [--workers 4]
+##
+## Readers see either the old or the new tables of a kind, never a partial load.
+## cluster_state and cluster_sync are written too, so `init_clusters.py
+## --incremental` carries on from a pipeline run.
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import init_clusters
+from clustering import build_clusters
+
+PIPELINE_KINDS = ("contributor", "hash", "keyword")
+## Rows sent per COPY round trip
+COPY_BATCH_ROWS = 50000
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+class Progress:
+    ## Reports "<stage> done/total chunks, rows, rows/s" at most every `interval`
+    ## seconds, and a summary once the stage is finished
+    def __init__(self, stage, total=None, interval=1.0):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.rows = 0
+        self.started = self.last_report = time.perf_counter()
+
+    def advance(self, rows, chunks=1):
+        self.done += chunks
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            of = f"/{self.total}" if self.total is not None else ""
+            log(f"{self.stage:<11} {self.done}{of} chunks  {self.rows} rows  "
+                f"{self.rows / (now - self.started):.0f} rows/s")
+
+    def finish(self, **extra):
+        seconds = time.perf_counter() - self.started
+        rate = self.rows / seconds if seconds else 0.0
+        log(f"{self.stage:<11} done  {self.rows} rows in {seconds:.2f}s  {rate:.0f} rows/s")
+        return {"stage": self.stage, "rows": self.rows, "seconds": seconds, "rows_per_second": rate, **extra}
+
+
+#region Extract and index
+## Connection of a pool worker, opened once per process
+worker_conn = None
+
+def open_worker_connection():
+    global worker_conn
+    worker_conn = init_clusters.connect()
+
+def plan_ranges(cur, chunk_size):
+    ## [(lo, hi)] id ranges of about chunk_size rows each, using the primary key index
+    cur.execute("""
+        SELECT id FROM (SELECT id, row_number() OVER (ORDER BY id) - 1 AS n FROM osc_dataset) numbered
+        WHERE n %% %s = 0 ORDER BY id;
+    """, (chunk_size,))
+    starts = [row[0] for row in cur.fetchall()]
+    if not starts:
+        return []
+    cur.execute("SELECT max(id) FROM osc_dataset;")
+    return list(zip(starts, starts[1:] + [cur.fetchone()[0] + 1]))
+
+def extract_range(kinds, lo, hi):
+    ## Extract and index stages of one id range. Returns ({kind: [(artifact_id,
+    ## keys)]}, rows read, seconds reading, seconds computing keys).
+    started = time.perf_counter()
+    with worker_conn.cursor() as cur:
+        cur.execute("SELECT artifact_id, data FROM osc_dataset WHERE id >= %s AND id < %s;", (lo, hi))
+        rows = cur.fetchall()
+    worker_conn.rollback()
+    read_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    keys = {
+        kind: [(artifact_id, init_clusters.INDEX_TABLES[kind][2](data)) for artifact_id, data in rows]
+        for kind in kinds
+    }
+    return keys, len(rows), read_seconds, time.perf_counter() - started
+
+def extract(kinds, ranges, workers):
+    ## Runs extract_range over every range, on a pool of `workers` processes (in
+    ## this process when workers is 0). Returns ({kind: {artifact_id: set of
+    ## keys}}, stage stats); rows sharing an artifact_id have their keys merged.
+    artifact_keys = {kind: defaultdict(set) for kind in kinds}
+    progress = Progress("extract", len(ranges))
+    index_seconds = read_seconds = 0.0
+
+    def merge(result):
+        nonlocal index_seconds, read_seconds
+        keys, rows, read, index = result
+        for kind, artifacts in keys.items():
+            merged = artifact_keys[kind]
+            for artifact_id, found in artifacts:
+                merged[artifact_id].update(found)
+        read_seconds += read
+        index_seconds += index
+        progress.advance(rows)
+
+    if workers == 0:
+        open_worker_connection()
+        try:
+            for lo, hi in ranges:
+                merge(extract_range(kinds, lo, hi))
+        finally:
+            worker_conn.close()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=open_worker_connection) as executor:
+            futures = [executor.submit(extract_range, kinds, lo, hi) for lo, hi in ranges]
+            for future in as_completed(futures):
+                merge(future.result())
+
+    stats = progress.finish(workers=workers, chunks=len(ranges), read_seconds=read_seconds)
+    return artifact_keys, [stats, {
+        "stage": "index",
+        "rows": stats["rows"],
+        ## Summed over the workers, so it can exceed the wall time of extract
+        "seconds": index_seconds,
+        "rows_per_second": stats["rows"] / index_seconds if index_seconds else 0.0,
+    }]
+#endregion
+
+#region Load
+def copy_value(value):
+    ## One field in COPY text format
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def text_array(values):
+    ## Literal of a text[] value
+    return "{" + ",".join('"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"' for value in values) + "}"
+
+def copy_rows(cur, table, columns, rows):
+    ## Streams rows into table with COPY, COPY_BATCH_ROWS at a time; returns the row count
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN;"
+    buffer = io.StringIO()
+    count = 0
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+        count += 1
+        if count % COPY_BATCH_ROWS == 0:
+            buffer.seek(0)
+            cur.copy_expert(statement, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        buffer.seek(0)
+        cur.copy_expert(statement, buffer)
+    return count
+
+INDEX_DEFINITION = re.compile(r"^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON (?:ONLY )?)(\S+)(.*)$", re.S)
+
+def stage_table(cur, table, columns, rows):
+    ## Loads rows into {table}_staging, a copy of table's columns, and builds
+    ## table's indexes on it afterwards (faster than maintaining them during the
+    ## COPY). Returns what swap_table needs and the row count.
+    staging = f"{table}_staging"
+    cur.execute(f"DROP TABLE IF EXISTS {staging};")
+    cur.execute(f"CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS);")
+    count = copy_rows(cur, staging, columns, rows)
+
+    cur.execute("""
+        SELECT conname, contype FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u');
+    """, (table,))
+    constraints = dict(cur.fetchall())
+    cur.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = 'public' AND tablename = %s;", (table,))
+    renames = []
+    for i, (name, definition) in enumerate(sorted(cur.fetchall())):
+        staged_name = f"{staging}_{i}"
+        cur.execute(INDEX_DEFINITION.sub(lambda m: f"{m[1]}{staged_name}{m[3]}public.{staging}{m[5]}", definition))
+        if name in constraints:
+            constraint = "PRIMARY KEY" if constraints[name] == "p" else "UNIQUE"
+            cur.execute(f"ALTER TABLE {staging} ADD CONSTRAINT {staged_name} {constraint} USING INDEX {staged_name};")
+        renames.append((staged_name, name, name in constraints))
+
+    cur.execute("SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal;", (table,))
+    triggers = [definition for (definition,) in cur.fetchall()]
+    return (table, renames, triggers), count
+
+def swap_table(cur, staged):
+    ## Replaces the live table with its staging table under the original index,
+    ## constraint and trigger names. Holds the table's exclusive lock until commit.
+    table, renames, triggers = staged
+    cur.execute(f"DROP TABLE {table};")
+    cur.execute(f"ALTER TABLE {table}_staging RENAME TO {table};")
+    for staged_name, name, is_constraint in renames:
+        if is_constraint:
+            cur.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {staged_name} TO {name};")
+        else:
+            cur.execute(f"ALTER INDEX {staged_name} RENAME TO {name};")
+    for definition in triggers:
+        cur.execute(definition)
+
+def load_kind(conn, kind, artifact_keys, clusters, watermark):
+    ## Load stage of one kind in one transaction: staging tables first, rows of
+    ## the tables shared between kinds next, the swaps (exclusive locks) last.
+    ## Returns the number of rows written.
+    index_table, key_column, _ = init_clusters.INDEX_TABLES[kind]
+    staged = []
+    rows = 0
+    try:
+        with conn.cursor() as cur:
+            table, count = stage_table(cur, index_table, (key_column, "artifact_id"), (
+                (key, artifact_id) for artifact_id in sorted(artifact_keys) for key in sorted(artifact_keys[artifact_id])
+            ))
+            staged.append(table)
+            rows += count
+
+            if kind == "contributor":
+                ## contributor_summary is kept by trigger on contributor_artifacts, which the COPY bypasses
+                counts = defaultdict(int)
+                for keys in artifact_keys.values():
+                    for contributor in keys:
+                        counts[contributor] += 1
+                table, count = stage_table(cur, "contributor_summary", ("contributor", "num_artifacts"), sorted(counts.items()))
+                staged.append(table)
+                rows += count
+            else:
+                cluster_table, name_column, _ = init_clusters.CLUSTER_KINDS[kind]
+                table, count = stage_table(cur, cluster_table, (name_column, "edges", "component"), (
+                    (name, json.dumps(edges), component)
+                    for component, (_, name, edges) in clusters.items()
+                    if edges
+                ))
+                staged.append(table)
+                rows += count
+
+                lod_nodes, lod_edges = init_clusters.lod_rows(kind, clusters)
+                cur.execute("DELETE FROM cluster_lod_nodes WHERE kind = %s;", (kind,))
+                cur.execute("DELETE FROM cluster_lod_edges WHERE kind = %s;", (kind,))
+                rows += copy_rows(cur, "cluster_lod_nodes", ("kind", "component", "level", "node", "parent", "size"), lod_nodes)
+                rows += copy_rows(cur, "cluster_lod_edges", ("kind", "component", "level", "node1", "node2", "weight"), lod_edges)
+
+                cur.execute("DELETE FROM cluster_state WHERE kind = %s;", (kind,))
+                rows += copy_rows(cur, "cluster_state", ("kind", "artifact_id", "component", "keys"), (
+                    (kind, artifact_id, component, text_array(sorted(artifact_keys[artifact_id])))
+                    for component, (members, _, _) in clusters.items()
+                    for artifact_id in members
+                ))
+                cur.execute("""
+                    INSERT INTO cluster_sync (kind, last_run) VALUES (%s, %s)
+                    ON CONFLICT (kind) DO UPDATE SET last_run = EXCLUDED.last_run;
+                """, (kind, watermark))
+
+            for table in staged:
+                swap_table(cur, table)
+            init_clusters.mark_cluster_build(cur, kind)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows
+#endregion
+
+def run_pipeline(kinds, workers, chunk_size, snapshot=None):
+    ## Rebuilds the tables of every kind in `kinds`, then publishes the graph
+    ## snapshot when a path is given; returns the stats of each stage
+    conn = init_clusters.connect()
+    try:
+        with conn.cursor() as cur:
+            init_clusters.ensure_cluster_state(cur)
+            ## Rows changed after this point are left to the next incremental run
+            cur.execute("SELECT now()::timestamp;")
+            watermark = cur.fetchone()[0]
+            ranges = plan_ranges(cur, chunk_size)
+        conn.commit()
+
+        artifact_keys, stats = extract(kinds, ranges, workers)
+
+        clusters = {}
+        progress = Progress("components")
+        for kind in kinds:
+            if kind in init_clusters.CLUSTER_KINDS:
+                clusters[kind] = build_clusters(artifact_keys[kind])
+            progress.advance(len(artifact_keys[kind]))
+        stats.append(progress.finish(clusters={
+            kind: sum(1 for _, _, edges in kind_clusters.values() if edges) for kind, kind_clusters in clusters.items()
+        }))
+
+        progress = Progress("load", len(kinds))
+        for kind in kinds:
+            progress.advance(load_kind(conn, kind, artifact_keys[kind], clusters.get(kind), watermark))
+        stats.append(progress.finish())
+
+        if "hash" in kinds:
+            progress = Progress("edges", 1)
+            init_clusters.refresh_hash_edges(conn)
+            progress.advance(0)
+            stats.append(progress.finish())
+
+        if snapshot:
+            progress = Progress("snapshot", 1)
+            header = init_clusters.publish_snapshot(conn, snapshot)
+            progress.advance(header["artifacts"])
+            stats.append(progress.finish(version=header["version"]))
+    finally:
+        conn.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the cluster tables with a parallel batch pipeline.")
+    parser.add_argument("--kind", choices=PIPELINE_KINDS, action="append",
+                        help="cluster kind to build (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="extract processes; 0 extracts in this process")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="osc_dataset rows per extract range")
+    parser.add_argument("--json", help="also write the stage stats to this file")
+    parser.add_argument("--snapshot", default=os.getenv('GRAPH_SNAPSHOT'),
+                        help="publish the artifact graph snapshot to this file afterwards (default: $GRAPH_SNAPSHOT)")
+    args = parser.parse_args()
+
+    kinds = sorted(set(args.kind or PIPELINE_KINDS))
+    stats = run_pipeline(kinds, args.workers, args.chunk_size, args.snapshot)
+
+    print(f"{'stage':<11} {'rows':>10} {'seconds':>9} {'rows/s':>10}")
+    for stage in stats:
+        print(f"{stage['stage']:<11} {stage['rows']:>10} {stage['seconds']:>9.2f} {stage['rows_per_second']:>10.0f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"kinds": kinds, "stages": stats}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import random
+from collections import defaultdict
+from itertools import combinations
+
+
+## Union-find over artifact ids. The smallest id of a component is always its
+## root, so component ids are stable no matter the order artifacts are merged in.
+class DisjointSet:
+    def __init__(self, items=()):
+        self.parent = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if root_b < root_a:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        return root_a
+
+    def groups(self):
+        members = defaultdict(list)
+        for item in self.parent:
+            members[self.find(item)].append(item)
+        return members
+
+
+def key_members(artifact_keys):
+    ## Inverts {artifact_id: keys} into {key: sorted artifact_ids}
+    members = defaultdict(set)
+    for artifact_id, keys in artifact_keys.items():
+        for key in keys:
+            members[key].add(artifact_id)
+    return {key: sorted(artifacts) for key, artifacts in members.items()}
+
+
+def connected_components(artifact_keys):
+    ## Returns (DisjointSet, {key: members}) for artifacts linked by any shared key
+    members = key_members(artifact_keys)
+    components = DisjointSet(artifact_keys)
+    for artifacts in members.values():
+        first = artifacts[0]
+        for other in artifacts[1:]:
+            components.union(first, other)
+    return components, members
+
+
+## Shared keys kept on an aggregated edge; the full list is served by /edge/<node1>/<node2>/<type>
+EDGE_SAMPLE = 5
+
+
+def pair_edge(node1, node2, shared):
+    ## One edge per artifact pair: how many keys they share plus the first few of them
+    return {"node1": node1, "node2": node2, "weight": len(shared), "shared": shared[:EDGE_SAMPLE]}
+
+
+def build_clusters(artifact_keys):
+    ## Groups artifacts into clusters the same way init_clusters always has:
+    ## the name is the sorted, comma-joined list of shared keys and there is one
+    ## edge (see pair_edge) for every distinct artifact pair sharing a key.
+    ## Returns {component_id: (members, cluster_name, edges)}; singletons have no edges.
+    components, members = connected_components(artifact_keys)
+    shared_keys = defaultdict(set)
+    pair_keys = defaultdict(dict)
+    for key in sorted(members):
+        artifacts = members[key]
+        if len(artifacts) < 2:
+            continue
+        component = components.find(artifacts[0])
+        shared_keys[component].add(key)
+        pairs = pair_keys[component]
+        for pair in combinations(artifacts, 2):
+            pairs.setdefault(pair, []).append(key)
+
+    return {
+        component: (
+            sorted(group),
+            ",".join(sorted(shared_keys[component])),
+            [pair_edge(node1, node2, shared) for (node1, node2), shared in pair_keys[component].items()],
+        )
+        for component, group in components.groups().items()
+    }
+
+
+def label_propagation(nodes, adjacency, max_rounds=20, seed=0):
+    ## Weighted label propagation: every node takes the label with the largest
+    ## total edge weight among its neighbours, keeping its own label when that is
+    ## one of the best. Nodes are visited in a shuffled order and other ties are
+    ## broken at random (a fixed order lets one label sweep across bridges); the
+    ## generator is seeded, so a cluster always coarsens the same way.
+    ## Returns {node: community label}.
+    rng = random.Random(seed)
+    order = sorted(nodes)
+    label = {node: node for node in order}
+    for _ in range(max_rounds):
+        rng.shuffle(order)
+        changed = False
+        for node in order:
+            weights = defaultdict(int)
+            for other, weight in adjacency[node].items():
+                weights[label[other]] += weight
+            if not weights:
+                continue
+            top = max(weights.values())
+            if weights.get(label[node]) == top:
+                continue
+            label[node] = rng.choice(sorted(candidate for candidate, weight in weights.items() if weight == top))
+            changed = True
+        if not changed:
+            break
+    return label
+
+
+def coarsen(members, edges):
+    ## Level-of-detail hierarchy of one cluster. Level 0 holds the artifacts and
+    ## their weighted pair edges; every further level groups the nodes of the one
+    ## below into communities (label_propagation) whose edge weights are summed.
+    ## When a level no longer shrinks, everything left becomes one root node, so
+    ## the last level always has a single node.
+    ## Returns [(nodes, edges), ...] per level where nodes is {node: (size, parent)}
+    ## (size counts artifacts, parent is the node one level up, None at the root)
+    ## and edges is {(node1, node2): weight} with node1 < node2. Super-nodes are
+    ## named "<level>:<smallest artifact id inside>".
+    sizes = {artifact_id: 1 for artifact_id in members}
+    first = {artifact_id: artifact_id for artifact_id in members}
+    level_edges = {}
+    for edge in edges:
+        pair = tuple(sorted((edge["node1"], edge["node2"])))
+        level_edges[pair] = level_edges.get(pair, 0) + edge.get("weight", 1)
+
+    levels = []
+    level = 0
+    while True:
+        nodes = sorted(sizes)
+        if len(nodes) > 1:
+            adjacency = defaultdict(dict)
+            for (node1, node2), weight in level_edges.items():
+                adjacency[node1][node2] = weight
+                adjacency[node2][node1] = weight
+            label = label_propagation(nodes, adjacency)
+            if len(set(label.values())) == len(nodes):
+                label = {node: nodes[0] for node in nodes}
+        else:
+            label = None
+
+        if label is None:
+            levels.append(({node: (sizes[node], None) for node in nodes}, level_edges))
+            return levels
+
+        groups = defaultdict(list)
+        for node in nodes:
+            groups[label[node]].append(node)
+        parent = {}
+        next_sizes = {}
+        next_first = {}
+        for group in groups.values():
+            smallest = min(first[node] for node in group)
+            name = f"{level + 1}:{smallest}"
+            next_sizes[name] = sum(sizes[node] for node in group)
+            next_first[name] = smallest
+            for node in group:
+                parent[node] = name
+        next_edges = {}
+        for (node1, node2), weight in level_edges.items():
+            parent1, parent2 = parent[node1], parent[node2]
+            if parent1 != parent2:
+                pair = (parent1, parent2) if parent1 < parent2 else (parent2, parent1)
+                next_edges[pair] = next_edges.get(pair, 0) + weight
+
+        levels.append(({node: (sizes[node], parent[node]) for node in nodes}, level_edges))
+        sizes, first, level_edges = next_sizes, next_first, next_edges
+        level += 1
+
+
+## Cluster keys of one osc_dataset `data` document
+def manifest_hashes(data):
+    manifest = data.get("public_fields", {}).get("manifest", []) or []
+    return sorted({item.get("hash") for item in manifest if item.get("hash")})
+
+def artifact_keywords(data):
+    keywords = data.get("public_fields", {}).get("keywords", []) or []
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    return sorted({keyword.strip() for keyword in keywords if keyword and keyword.strip()})
+
+def artifact_contributors(data):
+    contributor = data.get("public_fields", {}).get("contributor", "") or ""
+    return [contributor.strip()] if contributor.strip() else []
@@ -0,0 +1,107 @@
+import sys
+from array import array
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPACT_MIMETYPE = "application/vnd.osc.graph+json"
+MSGPACK_MIMETYPE = "application/vnd.osc.graph+msgpack"
+COMPACT_FORMAT = "osc-graph-compact/1"
+
+
+## Compact wire form of a graph: every artifact id and every key (hash, keyword)
+## is sent once in a dictionary, and edges are parallel integer columns indexing
+## into those dictionaries:
+##
+##   {"format": "osc-graph-compact/1",
+##    "nodes": [artifact_id, ...], "node_data": {"title": [...], ...},
+##    "keys": [key, ...], "key_data": {"files": [...], ...},
+##    "edges": {"node1": [i, ...], "node2": [j, ...], "key": [k, ...]}}
+##
+## Edges that carry several keys use "key" as a flat list split by "key_offsets"
+## (edge e owns key[key_offsets[e]:key_offsets[e + 1]]). Nodes can carry keys the
+## same way through node_data "keys" / "key_offsets".
+class CompactGraph:
+    def __init__(self):
+        self.nodes = []
+        self.node_index = {}
+        self.keys = []
+        self.key_index = {}
+        self.node_data = {}
+        self.key_data = {}
+        self.edges = {"node1": array('l'), "node2": array('l')}
+        self.extra = {}
+
+    def node(self, node_id):
+        i = self.node_index.get(node_id)
+        if i is None:
+            i = self.node_index[node_id] = len(self.nodes)
+            self.nodes.append(node_id)
+        return i
+
+    def key(self, key):
+        k = self.key_index.get(key)
+        if k is None:
+            k = self.key_index[key] = len(self.keys)
+            self.keys.append(key)
+        return k
+
+    def column(self, name):
+        ## Integer edge column, created on first use
+        return self.edges.setdefault(name, array('l'))
+
+    def add_edge(self, node1, node2, keys=None, multi=False):
+        ## keys is one key, or a list of keys when multi is set
+        self.column("node1").append(self.node(node1))
+        self.column("node2").append(self.node(node2))
+        if multi:
+            offsets = self.edges.get("key_offsets")
+            if offsets is None:
+                offsets = self.edges["key_offsets"] = array('l', [0])
+            self.column("key").extend(self.key(k) for k in keys)
+            offsets.append(len(self.column("key")))
+        elif keys is not None:
+            self.column("key").append(self.key(keys))
+
+    @classmethod
+    def from_edges(cls, edges, key_field=None, multi=False, weight_field=None):
+        ## Builds the compact form of a list of {"node1", "node2", key_field,
+        ## weight_field} edge dicts; missing multi keys count as none, missing weights as 1
+        graph = cls()
+        weights = graph.column("weight") if weight_field else None
+        for edge in edges:
+            keys = edge.get(key_field) if key_field else None
+            graph.add_edge(edge["node1"], edge["node2"], keys or [] if multi else keys, multi)
+            if weights is not None:
+                weights.append(edge.get(weight_field, 1))
+        return graph
+
+    def to_dict(self, packed=False):
+        ## packed turns integer columns into little-endian int32 bytes, which load
+        ## directly into an Int32Array on the client
+        def column(values):
+            if not packed:
+                return list(values)
+            values = array('i', values)
+            if sys.byteorder != "little":
+                values.byteswap()
+            return values.tobytes()
+
+        node_data = {
+            name: column(values) if isinstance(values, array) else values
+            for name, values in self.node_data.items()
+        }
+        return {
+            "format": COMPACT_FORMAT,
+            "nodes": self.nodes,
+            "node_data": node_data,
+            "keys": self.keys,
+            "key_data": self.key_data,
+            "edges": {name: column(values) for name, values in self.edges.items()},
+            **self.extra,
+        }
+
+    def encode_msgpack(self):
+        return msgpack.packb(self.to_dict(packed=True), use_bin_type=True)
@@ -0,0 +1,248 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+from codecs import utf_8_decode
+from datetime import datetime, timezone
+
+from artifact_graph import ArtifactGraph, Relation
+
+## Read-only ArtifactGraph snapshot in one file. init_clusters.py and
+## cluster_pipeline.py publish it (--snapshot); every backend worker maps the
+## same file, so the graph's pages are shared through the page cache and a
+## worker is ready as soon as the header is read.
+##
+## Layout: MAGIC, a uint32 header length, the JSON header, then 8-byte aligned
+## sections in native byte order. The header gives the format, the snapshot
+## version (one more than the snapshot it replaced), the time it was written
+## and every section as name -> [offset from the first section, typecode, count]:
+##
+##   <relation>.artifact_offsets / artifact_keys / key_offsets / key_artifacts
+##                   the Relation CSR arrays of hash, keyword and contributor
+##   <table>.offsets, <table>.data
+##                   a string table: UTF-8 bytes of string i at data[offsets[i]:offsets[i + 1]]
+##   <table>.order   positions of a table sorted by their bytes, so a string is
+##                   found by binary search instead of a dict built at startup
+##   hash_files.offsets
+##                   filenames of hash key k: files[hash_files.offsets[k]:hash_files.offsets[k + 1]]
+##
+## Tables: artifact_ids, titles, files and <relation>.keys.
+MAGIC = b"OSCGRAPH"
+SNAPSHOT_FORMAT = 1
+RELATIONS = ("hash", "keyword", "contributor")
+CSR_ARRAYS = ("artifact_offsets", "artifact_keys", "key_offsets", "key_artifacts")
+ALIGN = 8
+
+
+class StringTable:
+    ## Sequence of the strings of one table, decoded on access
+    def __init__(self, offsets, data, order=None):
+        self.offsets = offsets
+        self.data = data
+        self.order = order
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        offsets = self.offsets
+        if i < 0:
+            i += len(offsets) - 1
+        return utf_8_decode(self.data[offsets[i]:offsets[i + 1]])[0]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def raw(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def position(self, value):
+        ## Position of value through the sorted order, or None
+        target = value.encode("utf-8")
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(self.order[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.order) and self.raw(self.order[lo]) == target:
+            return self.order[lo]
+        return None
+
+
+class StringIndex:
+    ## The string -> position mapping of a sorted StringTable (the read-only
+    ## part of the dict it stands in for)
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, value, default=None):
+        if not isinstance(value, str):
+            return default
+        position = self.table.position(value)
+        return default if position is None else position
+
+    def __getitem__(self, value):
+        position = self.get(value)
+        if position is None:
+            raise KeyError(value)
+        return position
+
+    def __contains__(self, value):
+        return self.get(value) is not None
+
+    def __len__(self):
+        return len(self.table)
+
+
+class RaggedStrings:
+    ## Sequence of string lists: item k is files[offsets[k]:offsets[k + 1]]
+    def __init__(self, offsets, strings):
+        self.offsets = offsets
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k):
+        strings = self.strings
+        return [strings[i] for i in range(self.offsets[k], self.offsets[k + 1])]
+
+
+def string_sections(name, strings, sort=False):
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = array('q', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    sections = {f"{name}.offsets": offsets, f"{name}.data": b"".join(encoded)}
+    if sort:
+        sections[f"{name}.order"] = array('q', sorted(range(len(encoded)), key=encoded.__getitem__))
+    return sections
+
+def graph_sections(graph):
+    sections = {}
+    sections.update(string_sections("artifact_ids", graph.artifact_ids, sort=True))
+    sections.update(string_sections("titles", ["" if title is None else str(title) for title in graph.titles]))
+    for kind in RELATIONS:
+        relation = graph.relations[kind]
+        sections.update(string_sections(f"{kind}.keys", relation.keys, sort=True))
+        for name in CSR_ARRAYS:
+            sections[f"{kind}.{name}"] = array('q', getattr(relation, name))
+
+    files = []
+    file_offsets = array('q', [0])
+    for filenames in graph.hash_files:
+        files.extend("" if filename is None else str(filename) for filename in filenames)
+        file_offsets.append(len(files))
+    sections.update(string_sections("files", files))
+    sections["hash_files.offsets"] = file_offsets
+    return sections
+
+def parse_header(data, name):
+    ## (header, offset of the first section) from the start of a snapshot file
+    prefix = len(MAGIC) + 4
+    if len(data) < prefix or data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{name} is not a graph snapshot")
+    length = int.from_bytes(data[len(MAGIC):prefix], sys.byteorder)
+    header = json.loads(bytes(data[prefix:prefix + length]))
+    if header.get("format") != SNAPSHOT_FORMAT or header.get("byteorder") != sys.byteorder:
+        raise ValueError(f"{name} is a format {header.get('format')} {header.get('byteorder')}-endian snapshot")
+    start = prefix + length
+    return header, start + (-start) % ALIGN
+
+def read_header(path):
+    with open(path, "rb") as f:
+        data = f.read(len(MAGIC) + 4)
+        if len(data) == len(MAGIC) + 4:
+            data += f.read(int.from_bytes(data[len(MAGIC):], sys.byteorder))
+    return parse_header(data, path)[0]
+
+def write_snapshot(graph, path):
+    ## Writes graph to path and returns its header. The file is written next to
+    ## path and renamed over it, so readers only ever see complete snapshots;
+    ## workers that mapped the old file keep it until they swap.
+    try:
+        version = read_header(path)["version"] + 1
+    except (OSError, ValueError):
+        version = 1
+    sections = graph_sections(graph)
+
+    ## Section offsets count from the first section, after the padded header
+    layout = {}
+    position = 0
+    for name, values in sections.items():
+        typecode = values.typecode if isinstance(values, array) else "B"
+        layout[name] = [position, typecode, len(values)]
+        size = len(values) * (values.itemsize if isinstance(values, array) else 1)
+        position += size + (-size) % ALIGN
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "byteorder": sys.byteorder,
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "artifacts": len(graph.artifact_ids),
+        "sections": layout,
+    }
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(encoded).to_bytes(4, sys.byteorder))
+            f.write(encoded)
+            f.write(b"\0" * ((-f.tell()) % ALIGN))
+            for values in sections.values():
+                data = values.tobytes() if isinstance(values, array) else values
+                f.write(data)
+                f.write(b"\0" * ((-len(data)) % ALIGN))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return header
+
+def open_snapshot(path):
+    ## Maps the snapshot at path as an ArtifactGraph whose arrays and strings are
+    ## views into the mapping; nothing is copied. graph.snapshot is its header.
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    header, start = parse_header(view, path)
+
+    def section(name):
+        offset, typecode, count = header["sections"][name]
+        offset += start
+        data = view[offset:offset + count * array(typecode).itemsize]
+        return data if typecode == "B" else data.cast(typecode)
+
+    def table(name, sort=False):
+        return StringTable(section(f"{name}.offsets"), section(f"{name}.data"), section(f"{name}.order") if sort else None)
+
+    relations = {}
+    for kind in RELATIONS:
+        keys = table(f"{kind}.keys", sort=True)
+        relations[kind] = Relation(keys, *(section(f"{kind}.{name}") for name in CSR_ARRAYS), key_index=StringIndex(keys))
+    artifact_ids = table("artifact_ids", sort=True)
+    graph = ArtifactGraph(
+        artifact_ids,
+        table("titles"),
+        relations,
+        RaggedStrings(section("hash_files.offsets"), table("files")),
+        index=StringIndex(artifact_ids),
+    )
+    graph.snapshot = header
+    return graph
+
+def snapshot_stamp(path):
+    ## Changes whenever a snapshot is published to path; None without one
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
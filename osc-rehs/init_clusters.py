@@ -1,8 +1,15 @@
 import psycopg2
+from psycopg2.extras import execute_values
+import argparse
 import os
 from collections import defaultdict
 from dotenv import load_dotenv
 import json
+from datetime import datetime, timedelta
+
+from artifact_graph import ArtifactGraph
+from clustering import artifact_contributors, artifact_keywords, build_clusters, coarsen, manifest_hashes
+from graph_snapshot import write_snapshot
 
 load_dotenv()
 
@@ -49,19 +56,10 @@ def recurse_keywords(cur, artifact_id, edge_list, seen_edges, keywords, visited_
 def find_artifacts_with_shared_keywords(cur, artifact_id):
     ## query returns the artifacts that share the keyword along with the keyword that they share
     cur.execute("""
-        WITH artifact_keywords AS (
-            SELECT TRIM(keyword) AS keyword
-            FROM keyword_index,
-                unnest(string_to_array(artifact_ids, ',')) AS aid
-            WHERE aid = %s
-        )
-        SELECT
-            aid2 AS shared_artifact_id,
-            TRIM(ki.keyword) AS shared_keyword
-        FROM keyword_index ki
-        JOIN LATERAL unnest(string_to_array(ki.artifact_ids, ',')) AS aid2 ON TRUE
-        JOIN artifact_keywords ak ON TRIM(ki.keyword) = ak.keyword
-        WHERE aid2 != %s;
+        SELECT other.artifact_id AS shared_artifact_id, other.keyword AS shared_keyword
+        FROM keyword_artifacts mine
+        JOIN keyword_artifacts other ON other.keyword = mine.keyword
+        WHERE mine.artifact_id = %s AND other.artifact_id != %s;
     """, (artifact_id, artifact_id))
 
 
@@ -74,29 +72,15 @@ def find_artifacts_with_shared_keywords(cur, artifact_id):
 
 ## Cluster by hashes
 def generating_hash_index(cur):
+    ## Every hash listed by more than one manifest entry, with its comma-joined artifact_ids
     cur.execute("""
-        SELECT jsonb_agg(jsonb_build_object(hash, artifact_ids)) AS hash_artifact_map
-        FROM (
-            SELECT 
-                manifest_entry->>'hash' AS hash,
-                ARRAY_AGG(artifact_id) AS artifact_ids
-            FROM osc_dataset,
-                jsonb_array_elements(data->'public_fields'->'manifest') AS manifest_entry
-            GROUP BY hash
-            HAVING COUNT(*) > 1
-        ) AS sub;
+        INSERT INTO hash_index (hash, artifact_ids)
+        SELECT hash, string_agg(DISTINCT artifact_id, ',')
+        FROM manifest_entries
+        GROUP BY hash
+        HAVING COUNT(*) > 1;
     """)
-    
-    hashes = cur.fetchone()[0]  # This is a list of dicts like [{"hash1": [1, 2]}, ...]
-    hash_artifact_list = json.loads(json.dumps(hashes))  # Make it a Python list of dicts
-
-    for item in hash_artifact_list:
-        for h, artifacts in item.items():
-            cur.execute("""
-                INSERT INTO hash_index (hash, artifact_ids)
-                VALUES (%s, %s)
-            """, (h, artifacts))
-            conn.commit()
+    conn.commit()
 
 ## Initializing PSQL table
 def init_hash_clusters(artifact_ids, cur):
@@ -139,20 +123,11 @@ def recurse_hashes(cur, artifact_id, edge_list, seen_edges, hashes, visited_arti
 
 def find_artifacts_with_shared_hashes(cur, artifact_id):
     cur.execute("""
-    WITH artifact_hashes AS (
-        SELECT TRIM(hash) AS hash
-        FROM hash_index,
-            unnest(string_to_array(artifact_ids, ',')) AS aid
-        WHERE aid = %s
-    )
-    SELECT
-        aid2 AS shared_artifact_id,
-        TRIM(ki.hash) AS shared_hash
-    FROM hash_index ki
-    JOIN LATERAL unnest(string_to_array(ki.artifact_ids, ',')) AS aid2 ON TRUE
-    JOIN artifact_hashes ak ON TRIM(ki.hash) = ak.hash
-    WHERE aid2 != %s;
-""", (artifact_id, artifact_id))
+        SELECT other.artifact_id AS shared_artifact_id, other.hash AS shared_hash
+        FROM hash_artifacts mine
+        JOIN hash_artifacts other ON other.hash = mine.hash
+        WHERE mine.artifact_id = %s AND other.artifact_id != %s;
+    """, (artifact_id, artifact_id))
 
     
     
@@ -163,26 +138,340 @@ def find_artifacts_with_shared_hashes(cur, artifact_id):
     ## Returns the artifact and keyword that is shared    
     return shared
 
-conn = psycopg2.connect(    
-    f"host=localhost port=5432 dbname=osc_portal user={os.getenv('DB_USERNAME')} password={os.getenv('DB_PASSWORD')}"
-)
-cur = conn.cursor()
-
-cur.execute("drop table hash_clusters;")
-cur.execute("SELECT artifact_id FROM osc_dataset")
-all_artifact_ids = cur.fetchall()
-
-# ## Generate table
-cur.execute("""
-            CREATE TABLE hash_clusters(
-                cluster_hashes TEXT,
-                edges TEXT
-            );
-            """)
-conn.commit()
-
-init_hash_clusters(all_artifact_ids, cur)
-# init_keyword_cluster(all_artifact_ids, cur)
-
-cur.close()
-conn.close()
+#region Incremental clustering
+## kind -> (cluster table, cluster name column, function giving the keys of an artifact)
+CLUSTER_KINDS = {
+    "hash": ("hash_clusters", "cluster_hashes", manifest_hashes),
+    "keyword": ("keyword_clusters", "cluster_name", artifact_keywords),
+}
+## A row can commit after an incremental run with an updated_at older than the
+## watermark that run stored, so every run re-reads this window before it too
+SYNC_OVERLAP = timedelta(seconds=float(os.getenv('CLUSTER_SYNC_OVERLAP', 600)))
+
+def ensure_cluster_state(cur):
+    ## cluster_state, cluster_sync and the component columns of the cluster
+    ## tables come from migration 10; an older database is brought up to date here
+    apply_migrations(cur)
+
+def mark_cluster_build(cur, kind):
+    ## Lets the backend know the cluster table of `kind` changed
+    cur.execute("""
+        INSERT INTO cluster_builds (kind, built_at) VALUES (%s, now())
+        ON CONFLICT (kind) DO UPDATE SET built_at = EXCLUDED.built_at;
+    """, (kind,))
+
+def delete_clusters(cur, kind, components=None):
+    ## Removes the cluster rows and level-of-detail rows of `kind`, either all of
+    ## them or only those of the given components
+    table = CLUSTER_KINDS[kind][0]
+    if components is None:
+        cur.execute(f"DELETE FROM {table};")
+        cur.execute("DELETE FROM cluster_lod_nodes WHERE kind = %s;", (kind,))
+        cur.execute("DELETE FROM cluster_lod_edges WHERE kind = %s;", (kind,))
+    else:
+        cur.execute(f"DELETE FROM {table} WHERE component = ANY(%s);", (components,))
+        cur.execute("DELETE FROM cluster_lod_nodes WHERE kind = %s AND component = ANY(%s);", (kind, components))
+        cur.execute("DELETE FROM cluster_lod_edges WHERE kind = %s AND component = ANY(%s);", (kind, components))
+
+def lod_rows(kind, clusters):
+    ## The cluster_lod_nodes and cluster_lod_edges rows of every cluster with at least one edge
+    lod_nodes = []
+    lod_edges = []
+    for component, (members, _, edges) in clusters.items():
+        if not edges:
+            continue
+        for level, (nodes, level_edges) in enumerate(coarsen(members, edges)):
+            lod_nodes.extend((kind, component, level, node, parent, size) for node, (size, parent) in nodes.items())
+            lod_edges.extend((kind, component, level, node1, node2, weight) for (node1, node2), weight in level_edges.items())
+    return lod_nodes, lod_edges
+
+def insert_clusters(cur, kind, clusters):
+    ## Writes every cluster with at least one edge in a single batched INSERT,
+    ## together with its level-of-detail hierarchy (clustering.coarsen)
+    table, name_column, _ = CLUSTER_KINDS[kind]
+    execute_values(cur, f"INSERT INTO {table} ({name_column}, edges, component) VALUES %s;", [
+        (name, json.dumps(edges), component)
+        for component, (_, name, edges) in clusters.items()
+        if edges
+    ])
+    lod_nodes, lod_edges = lod_rows(kind, clusters)
+    execute_values(cur, "INSERT INTO cluster_lod_nodes (kind, component, level, node, parent, size) VALUES %s;", lod_nodes)
+    execute_values(cur, "INSERT INTO cluster_lod_edges (kind, component, level, node1, node2, weight) VALUES %s;", lod_edges)
+
+def update_clusters(conn, kind):
+    ## Folds the osc_dataset rows changed since the last run into the clusters of
+    ## `kind`. Only components touching a changed or deleted artifact are
+    ## reloaded, recomputed (merging or splitting as needed) and rewritten, all in
+    ## one transaction. The first run has no state yet and builds every cluster.
+    ## Rows re-read through SYNC_OVERLAP whose keys did not change are skipped, so
+    ## running it again is a no-op.
+    artifact_keys = CLUSTER_KINDS[kind][2]
+    try:
+        with conn.cursor() as cur:
+            ensure_cluster_state(cur)
+            cur.execute("SELECT last_run FROM cluster_sync WHERE kind = %s FOR UPDATE;", (kind,))
+            row = cur.fetchone()
+            last_run = row[0] if row else None
+
+            if last_run is None:
+                cur.execute("SELECT artifact_id, data, updated_at FROM osc_dataset;")
+            else:
+                cur.execute("SELECT artifact_id, data, updated_at FROM osc_dataset WHERE updated_at > %s;", (last_run - SYNC_OVERLAP,))
+            changed_rows = cur.fetchall()
+            changed = {artifact_id: artifact_keys(data) for artifact_id, data, _ in changed_rows}
+            watermark = max((updated_at for _, _, updated_at in changed_rows if updated_at), default=last_run or datetime.min)
+
+            deleted = []
+            if last_run is not None:
+                watermark = max(watermark, last_run)
+                cur.execute("SELECT artifact_id, keys FROM cluster_state WHERE kind = %s AND artifact_id = ANY(%s);", (kind, list(changed)))
+                for artifact_id, keys in cur.fetchall():
+                    if sorted(keys) == changed[artifact_id]:
+                        del changed[artifact_id]
+                ## Artifacts removed from osc_dataset leave their clusters
+                cur.execute("""
+                    SELECT s.artifact_id FROM cluster_state s
+                    WHERE s.kind = %s AND NOT EXISTS (SELECT 1 FROM osc_dataset d WHERE d.artifact_id = s.artifact_id);
+                """, (kind,))
+                deleted = [artifact_id for (artifact_id,) in cur.fetchall()]
+
+            if not changed and not deleted:
+                if last_run is not None:
+                    cur.execute("UPDATE cluster_sync SET last_run = %s WHERE kind = %s;", (watermark, kind))
+                conn.commit()
+                return 0
+
+            if last_run is None:
+                delete_clusters(cur, kind)
+                cur.execute("DELETE FROM cluster_state WHERE kind = %s;", (kind,))
+                affected = []
+                members = {}
+            else:
+                new_keys = sorted({key for keys in changed.values() for key in keys})
+                cur.execute("""
+                    SELECT DISTINCT component FROM cluster_state
+                    WHERE kind = %s AND (artifact_id = ANY(%s) OR keys && %s::text[]);
+                """, (kind, list(changed) + deleted, new_keys))
+                affected = [component for (component,) in cur.fetchall()]
+                cur.execute("""
+                    SELECT artifact_id, keys FROM cluster_state
+                    WHERE kind = %s AND component = ANY(%s);
+                """, (kind, affected))
+                members = dict(cur.fetchall())
+                for artifact_id in deleted:
+                    members.pop(artifact_id, None)
+                cur.execute("DELETE FROM cluster_state WHERE kind = %s AND artifact_id = ANY(%s);", (kind, deleted))
+            members.update(changed)
+
+            ## Keep the (key, artifact_id) rows of the changed and deleted artifacts in step
+            index_table, key_column, _ = INDEX_TABLES[kind]
+            cur.execute(f"DELETE FROM {index_table} WHERE artifact_id = ANY(%s);", (list(changed) + deleted,))
+            execute_values(cur, f"INSERT INTO {index_table} ({key_column}, artifact_id) VALUES %s ON CONFLICT DO NOTHING;", [
+                (key, artifact_id) for artifact_id, keys in changed.items() for key in keys
+            ])
+
+            clusters = build_clusters(members)
+            component_of = {
+                artifact_id: component
+                for component, (group, _, _) in clusters.items()
+                for artifact_id in group
+            }
+
+            delete_clusters(cur, kind, affected)
+            execute_values(cur, """
+                INSERT INTO cluster_state (kind, artifact_id, component, keys) VALUES %s
+                ON CONFLICT (kind, artifact_id)
+                DO UPDATE SET component = EXCLUDED.component, keys = EXCLUDED.keys;
+            """, [(kind, artifact_id, component_of[artifact_id], list(keys)) for artifact_id, keys in members.items()])
+            insert_clusters(cur, kind, clusters)
+            cur.execute("""
+                INSERT INTO cluster_sync (kind, last_run) VALUES (%s, %s)
+                ON CONFLICT (kind) DO UPDATE SET last_run = EXCLUDED.last_run;
+            """, (kind, watermark))
+            mark_cluster_build(cur, kind)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(changed) + len(deleted)
+#endregion
+
+#region Index tables
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql", "migrations")
+
+## kind -> ((key, artifact_id) table, key column, function giving the keys of an artifact)
+INDEX_TABLES = {
+    "hash": ("hash_artifacts", "hash", manifest_hashes),
+    "keyword": ("keyword_artifacts", "keyword", artifact_keywords),
+    "contributor": ("contributor_artifacts", "contributor", artifact_contributors),
+}
+
+def apply_migrations(cur):
+    ## Applies the sql/migrations files not yet recorded in schema_migrations, in name order
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+            name TEXT PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT now()
+        );
+    """)
+    cur.execute("SELECT name FROM schema_migrations;")
+    applied = {name for (name,) in cur.fetchall()}
+    for name in sorted(os.listdir(MIGRATIONS)):
+        if name.endswith(".sql") and name not in applied:
+            with open(os.path.join(MIGRATIONS, name)) as migration:
+                cur.execute(migration.read())
+            cur.execute("INSERT INTO schema_migrations (name) VALUES (%s);", (name,))
+
+def refresh_hash_edges(conn):
+    ## hash_edges is only refreshed on demand; manifest_entries itself is kept current by trigger
+    with conn.cursor() as cur:
+        cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY hash_edges;")
+    conn.commit()
+
+def publish_snapshot(conn, path):
+    ## Writes the artifact graph snapshot backend workers map (see graph_snapshot.py)
+    with conn.cursor() as cur:
+        graph = ArtifactGraph.load(cur)
+    conn.rollback()
+    return write_snapshot(graph, path)
+
+def build_index_tables(conn):
+    ## Rebuilds every (key, artifact_id) table from osc_dataset in one transaction
+    try:
+        with conn.cursor() as cur:
+            apply_migrations(cur)
+            cur.execute("SELECT artifact_id, data FROM osc_dataset;")
+            records = cur.fetchall()
+            for table, key_column, artifact_keys in INDEX_TABLES.values():
+                cur.execute(f"DELETE FROM {table};")
+                execute_values(cur, f"INSERT INTO {table} ({key_column}, artifact_id) VALUES %s ON CONFLICT DO NOTHING;", [
+                    (key, artifact_id)
+                    for artifact_id, data in records
+                    for key in artifact_keys(data)
+                ])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+#endregion
+
+#region Bulk clustering
+def load_index(cur, kind):
+    ## One bulk read of the index table, inverted into {artifact_id: keys}
+    table, key_column, _ = INDEX_TABLES[kind]
+    cur.execute(f"SELECT artifact_id, {key_column} FROM {table};")
+    artifact_keys = defaultdict(set)
+    for artifact_id, key in cur.fetchall():
+        artifact_keys[artifact_id].add(key)
+    return artifact_keys
+
+def rebuild_clusters(conn, kind):
+    ## Full rebuild without per-artifact queries or recursion: one read of the
+    ## index table, connected components in memory, one batched write.
+    try:
+        with conn.cursor() as cur:
+            ensure_cluster_state(cur)
+            clusters = build_clusters(load_index(cur, kind))
+            delete_clusters(cur, kind)
+            insert_clusters(cur, kind, clusters)
+            ## The rebuilt rows do not come from cluster_state, so the next incremental run starts over
+            cur.execute("DELETE FROM cluster_sync WHERE kind = %s;", (kind,))
+            mark_cluster_build(cur, kind)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return clusters
+#endregion
+
+def legacy_rebuild_hash_clusters(conn):
+    ## The original rebuild: one find_artifacts_with_shared_hashes query per visited artifact
+    cur = conn.cursor()
+
+    ## Emptied rather than dropped so the jsonb edges, edge_count and indexes from sql/migrations stay
+    ensure_cluster_state(cur)
+    delete_clusters(cur, "hash")
+    cur.execute("SELECT artifact_id FROM osc_dataset")
+    all_artifact_ids = cur.fetchall()
+    conn.commit()
+
+    init_hash_clusters(all_artifact_ids, cur)
+    # init_keyword_cluster(all_artifact_ids, cur)
+    backfill_components(cur, "hash")
+
+    ## The rebuilt rows do not come from cluster_state, so the next incremental run starts over
+    cur.execute("DELETE FROM cluster_sync WHERE kind = 'hash';")
+    mark_cluster_build(cur, "hash")
+    conn.commit()
+    cur.close()
+
+def backfill_components(cur, kind):
+    ## Gives the rows written by the legacy rebuild the component of their first
+    ## edge's artifact, and the level-of-detail rows /cluster/<kind>/<name>/lod needs
+    table, name_column, _ = CLUSTER_KINDS[kind]
+    clusters = build_clusters(load_index(cur, kind))
+    component_of = {
+        artifact_id: component
+        for component, (group, _, _) in clusters.items()
+        for artifact_id in group
+    }
+    cur.execute(f"SELECT {name_column}, edges->0->>'node1' FROM {table} WHERE component IS NULL;")
+    rows = [(name, component_of[artifact_id]) for name, artifact_id in cur.fetchall() if artifact_id in component_of]
+    execute_values(cur, f"""
+        UPDATE {table} SET component = data.component
+        FROM (VALUES %s) AS data (name, component)
+        WHERE {table}.{name_column} = data.name AND {table}.component IS NULL;
+    """, rows)
+    lod_nodes, lod_edges = lod_rows(kind, {component: clusters[component] for _, component in rows})
+    execute_values(cur, "INSERT INTO cluster_lod_nodes (kind, component, level, node, parent, size) VALUES %s;", lod_nodes)
+    execute_values(cur, "INSERT INTO cluster_lod_edges (kind, component, level, node1, node2, weight) VALUES %s;", lod_edges)
+
+def connect():
+    return psycopg2.connect(    
+        f"host=localhost port=5432 dbname={os.getenv('DB_DATABASE', 'osc_portal')} user={os.getenv('DB_USERNAME')} password={os.getenv('DB_PASSWORD')}"
+    )
+
+def main():
+    global conn
+    parser = argparse.ArgumentParser(description="Build the hash and keyword cluster tables.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only fold in osc_dataset rows updated since the last run")
+    parser.add_argument("--legacy", action="store_true",
+                        help="rebuild hash clusters with the original recursive per-artifact queries")
+    parser.add_argument("--kind", choices=sorted(CLUSTER_KINDS), action="append",
+                        help="cluster kind to build (default: all)")
+    parser.add_argument("--index-tables", action="store_true",
+                        help="only rebuild the (key, artifact_id) index tables")
+    parser.add_argument("--refresh-edges", action="store_true",
+                        help="only refresh the hash_edges materialized view")
+    parser.add_argument("--snapshot", default=os.getenv('GRAPH_SNAPSHOT'),
+                        help="publish the artifact graph snapshot to this file afterwards (default: $GRAPH_SNAPSHOT)")
+    args = parser.parse_args()
+
+    conn = connect()
+
+    if args.refresh_edges:
+        with conn.cursor() as cur:
+            apply_migrations(cur)
+        refresh_hash_edges(conn)
+    elif args.incremental:
+        for kind in args.kind or sorted(CLUSTER_KINDS):
+            count = update_clusters(conn, kind)
+            print(f"{kind}: {count} changed or deleted artifacts")
+    else:
+        build_index_tables(conn)
+        refresh_hash_edges(conn)
+        if args.legacy:
+            legacy_rebuild_hash_clusters(conn)
+        elif not args.index_tables:
+            for kind in args.kind or sorted(CLUSTER_KINDS):
+                clusters = rebuild_clusters(conn, kind)
+                print(f"{kind}: {sum(1 for _, _, edges in clusters.values() if edges)} clusters")
+
+    if args.snapshot:
+        header = publish_snapshot(conn, args.snapshot)
+        print(f"snapshot: version {header['version']} with {header['artifacts']} artifacts at {args.snapshot}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
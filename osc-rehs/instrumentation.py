@@ -0,0 +1,173 @@
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+## Upper bounds of the histogram buckets; the last bucket is +Inf
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SPANS = ("sql", "graph", "serialize")
+
+
+## Timings of one request. Spans measure self time: while a nested span runs
+## (e.g. SQL issued while a graph is built) the outer span's clock is paused,
+## so the spans of a request add up to at most its total time.
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mark = self.started
+        self.stack = []
+        self.spans = defaultdict(float)
+        self.queries = 0
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            self.spans[self.stack[-1]] += now - self.mark
+        self.stack.append(name)
+        self.mark = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.spans[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+@contextmanager
+def span(name):
+    ## Times the block under `name` in the current request's trace (no-op outside a request)
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    trace.enter(name)
+    try:
+        yield
+    finally:
+        trace.exit()
+
+
+## psycopg2 cursor that times every statement as an "sql" span and counts the
+## queries of the current request. Fetches a server-side cursor makes while it
+## is iterated are not included.
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        trace = current_trace.get()
+        if trace is None:
+            return super().execute(query, vars)
+        trace.enter("sql")
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.exit()
+            trace.queries += 1
+
+    def executemany(self, query, vars_list):
+        trace = current_trace.get()
+        if trace is None:
+            return super().executemany(query, vars_list)
+        trace.enter("sql")
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            trace.exit()
+            trace.queries += 1
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+## In-process request metrics per endpoint (the Flask url rule): latency, span
+## and query-count histograms, a response counter per status, and the slowest
+## requests seen so far with their full path.
+class RequestMetrics:
+    def __init__(self, slowest=20):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.spans = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.responses = defaultdict(int)
+        self.max_slowest = slowest
+        self.slowest = []
+
+    def record(self, endpoint, path, status, trace):
+        seconds = trace.elapsed()
+        with self.lock:
+            self.latency[endpoint].observe(seconds)
+            for name in SPANS:
+                self.spans[(endpoint, name)].observe(trace.spans.get(name, 0.0))
+            self.queries[endpoint].observe(trace.queries)
+            self.responses[(endpoint, status)] += 1
+            if len(self.slowest) < self.max_slowest or seconds > self.slowest[0][0]:
+                bisect.insort(self.slowest, (seconds, path, trace.queries, dict(trace.spans)), key=lambda entry: entry[0])
+                del self.slowest[:-self.max_slowest]
+        return seconds
+
+    def to_dict(self):
+        with self.lock:
+            endpoints = {}
+            for endpoint, histogram in self.latency.items():
+                endpoints[endpoint] = {
+                    "seconds": histogram.to_dict(),
+                    "spans": {name: self.spans[(endpoint, name)].to_dict() for name in SPANS},
+                    "queries": self.queries[endpoint].to_dict(),
+                    "responses": {status: count for (e, status), count in self.responses.items() if e == endpoint},
+                }
+            slowest = [
+                {"path": path, "seconds": seconds, "queries": queries, "spans": spans}
+                for seconds, path, queries, spans in reversed(self.slowest)
+            ]
+        return {"endpoints": endpoints, "slowest": slowest}
+
+    def to_prometheus(self):
+        ## Prometheus text exposition format
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def histogram_lines(name, labels, histogram):
+            cumulative = 0
+            for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+                cumulative += count
+                yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f"{name}_sum{{{labels}}} {histogram.sum}"
+            yield f"{name}_count{{{labels}}} {histogram.count}"
+
+        lines = []
+        with self.lock:
+            lines.append("# TYPE osc_request_seconds histogram")
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(histogram_lines("osc_request_seconds", f'endpoint="{escape(endpoint)}"', histogram))
+            lines.append("# TYPE osc_request_span_seconds histogram")
+            for (endpoint, name), histogram in sorted(self.spans.items()):
+                lines.extend(histogram_lines("osc_request_span_seconds", f'endpoint="{escape(endpoint)}",span="{name}"', histogram))
+            lines.append("# TYPE osc_request_queries histogram")
+            for endpoint, histogram in sorted(self.queries.items()):
+                lines.extend(histogram_lines("osc_request_queries", f'endpoint="{escape(endpoint)}"', histogram))
+            lines.append("# TYPE osc_responses_total counter")
+            for (endpoint, status), count in sorted(self.responses.items()):
+                lines.append(f'osc_responses_total{{endpoint="{escape(endpoint)}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
@@ -1,14 +1,40 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from dotenv import load_dotenv
 
 from flask_cors import CORS
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
 from contextlib import contextmanager
 from collections import defaultdict 
-import itertools
+from functools import wraps
 from itertools import combinations
+import argparse
+from bisect import bisect_left
+import base64
+from datetime import datetime
+import gzip
+import hashlib
+import json
 import os
+import queue
+import random
+import re
+import threading
+import time
+import weakref
+
+from artifact_graph import ArtifactGraph
+from clustering import EDGE_SAMPLE
+from graph_encoding import COMPACT_MIMETYPE, MSGPACK_MIMETYPE, CompactGraph
+import graph_encoding
+import graph_snapshot
+from instrumentation import RequestMetrics, TimedCursor, Trace, current_trace, span
+from response_cache import ResponseCache
+try:
+    from similarity import MinHashIndex
+except ImportError:
+    MinHashIndex = None
 
 app = Flask(__name__)
 
@@ -17,171 +43,689 @@ CORS(app, resources={
 })
 
 load_dotenv()
-db_pool = psycopg2.pool.SimpleConnectionPool(
-    minconn=1,
-    maxconn=10,
+## Pool sizing: DB_POOL_MAX is also the number of requests that can hold a connection at once
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+## Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+## Connections idle longer than this are pinged with SELECT 1 before being handed out
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))
+## Connections a checkout tries before giving up; after a database restart every
+## pooled connection can be stale, so the default goes through all of them once
+DB_POOL_CHECKOUT_ATTEMPTS = int(os.getenv('DB_POOL_CHECKOUT_ATTEMPTS', DB_POOL_MAX + 1))
+
+db_pool = psycopg2.pool.ThreadedConnectionPool(
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
     host="localhost",
     port=5432,
-    dbname="osc_portal",
+    dbname=os.getenv('DB_DATABASE', 'osc_portal'),
     user=os.getenv('DB_USERNAME'),
-    password=os.getenv('DB_PASSWORD')
+    password=os.getenv('DB_PASSWORD'),
+    cursor_factory=TimedCursor
 )
+## ThreadedConnectionPool raises PoolError when every connection is out; the
+## semaphore makes requests queue for a connection instead
+db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+db_pool_last_used = weakref.WeakKeyDictionary()
+
+def connection_is_healthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - db_pool_last_used.get(conn, 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
 @contextmanager
-def get_db_cursor():
-    conn = db_pool.getconn()
+def get_db_connection():
+    ## Checks a healthy connection out of the pool. On an error the transaction is
+    ## rolled back, and a broken connection is closed rather than put back.
+    if not db_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError("timed out waiting for a database connection")
+    conn = None
     try:
-        cur = conn.cursor()
-        yield cur
+        for _ in range(DB_POOL_CHECKOUT_ATTEMPTS):
+            conn = db_pool.getconn()
+            if connection_is_healthy(conn):
+                break
+            db_pool.putconn(conn, close=True)
+            conn = None
+        else:
+            raise psycopg2.OperationalError("no healthy database connection in the pool")
+        yield conn
         conn.commit()
-        cur.close()
+    except BaseException as e:
+        if conn is not None and not conn.closed:
+            if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                conn.close()
+            else:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+        raise
     finally:
-        db_pool.putconn(conn)
+        if conn is not None:
+            db_pool_last_used[conn] = time.monotonic()
+            db_pool.putconn(conn, close=conn.closed)
+        db_pool_slots.release()
+
+@contextmanager
+def get_db_cursor():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
+
+@contextmanager
+def get_db_named_cursor(name, itersize=2000):
+    ## Server-side cursor: rows arrive from PostgreSQL `itersize` at a time while iterating
+    with get_db_connection() as conn:
+        with conn.cursor(name=name) as cur:
+            cur.itersize = itersize
+            yield cur
+
+#region Instrumentation
+## Every request is traced (instrumentation.py): time in SQL, graph building and
+## serialization plus the number of queries, aggregated per endpoint on /metrics.
+## REQUEST_LOG_SAMPLE (0 to 1) is the share of requests written to the logs
+## table; requests slower than REQUEST_LOG_SLOW_MS (when set) are always written.
+REQUEST_LOG_SAMPLE = float(os.getenv('REQUEST_LOG_SAMPLE', 0))
+REQUEST_LOG_SLOW_MS = float(os.getenv('REQUEST_LOG_SLOW_MS', 0))
+## SERVER_TIMING=1 adds a Server-Timing header with the spans of every response
+SERVER_TIMING = os.getenv('SERVER_TIMING', '0') == '1'
+
+request_metrics = RequestMetrics()
+## Log rows wait here for request_log_writer; when it falls behind, rows are dropped
+request_log_queue = queue.Queue(maxsize=10000)
+request_log_thread = None
+request_log_lock = threading.Lock()
+
+def request_log_writer():
+    ## Writes queued rows to logs about once a second, in one INSERT per batch
+    while True:
+        rows = [request_log_queue.get()]
+        time.sleep(1)
+        while True:
+            try:
+                rows.append(request_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with get_db_cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO logs (date, method, url, status, remote_addr, response_time,
+                                      http_version, remote_user, res, referrer, user_agent)
+                    VALUES %s;
+                """, rows)
+        except Exception as e:
+            app.logger.warning("dropped %d request log rows: %s", len(rows), e)
+
+def log_request(response, seconds):
+    global request_log_thread
+    if request_log_thread is None:
+        with request_log_lock:
+            if request_log_thread is None:
+                request_log_thread = threading.Thread(target=request_log_writer, name="request-log", daemon=True)
+                request_log_thread.start()
+    protocol = request.environ.get('SERVER_PROTOCOL', '')
+    try:
+        request_log_queue.put_nowait((
+            datetime.now(), request.method, request.full_path.rstrip('?')[:255], response.status_code,
+            (request.remote_addr or '')[:50], seconds * 1000,
+            float(protocol.split('/')[-1]) if protocol.startswith('HTTP/') else None,
+            (request.remote_user or '')[:50] or None,
+            None if response.content_length is None else str(response.content_length),
+            (request.referrer or '')[:50] or None, (request.user_agent.string or '')[:255] or None,
+        ))
+    except queue.Full:
+        pass
+
+@app.before_request
+def start_trace():
+    g.trace_token = current_trace.set(Trace())
+
+## Registered before the other after_request hooks so it runs last and times them too
+@app.after_request
+def finish_trace(response):
+    trace = current_trace.get()
+    if trace is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    seconds = request_metrics.record(endpoint, request.full_path.rstrip('?'), response.status_code, trace)
+    if SERVER_TIMING:
+        timings = [f"{name};dur={trace.spans[name] * 1000:.2f}" for name in ("sql", "graph", "serialize") if name in trace.spans]
+        timings.append(f'queries;desc="{trace.queries}"')
+        timings.append(f"total;dur={seconds * 1000:.2f}")
+        response.headers['Server-Timing'] = ", ".join(timings)
+    if (REQUEST_LOG_SLOW_MS and seconds * 1000 >= REQUEST_LOG_SLOW_MS) or random.random() < REQUEST_LOG_SAMPLE:
+        log_request(response, seconds)
+    return response
+
+@app.teardown_request
+def end_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        current_trace.reset(token)
+
+## Prometheus text format by default, ?format=json for JSON including the slowest requests
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if request.args.get('format') == 'json':
+        return jsonify(request_metrics.to_dict())
+    return Response(request_metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
+#endregion
+
 #region
+## The artifact graph is built once from osc_dataset and shared by every request.
+## With GRAPH_SNAPSHOT set to the path init_clusters.py / cluster_pipeline.py
+## publish with --snapshot, workers map that file instead of building the graph,
+## and switch to a newly published snapshot at the next data version check.
+GRAPH_SNAPSHOT = os.getenv('GRAPH_SNAPSHOT')
+artifact_graph = None
+artifact_graph_lock = threading.Lock()
+
+def get_artifact_graph():
+    current_data_version()
+    if artifact_graph is None:
+        with artifact_graph_lock:
+            if artifact_graph is None:
+                refresh_artifact_graph()
+    return artifact_graph
+
+def refresh_artifact_graph():
+    ## Swaps a freshly loaded graph in; requests already running keep the old one
+    global artifact_graph
+    artifact_graph = load_artifact_graph()
+    return artifact_graph
+
+def load_artifact_graph():
+    ## Maps the published snapshot, or builds a fresh graph without one
+    graph = None
+    if GRAPH_SNAPSHOT:
+        with span("graph"):
+            try:
+                graph = graph_snapshot.open_snapshot(GRAPH_SNAPSHOT)
+            except FileNotFoundError:
+                app.logger.warning("no graph snapshot at %s yet, building the graph", GRAPH_SNAPSHOT)
+    if graph is None:
+        with get_db_cursor() as cur, span("graph"):
+            graph = ArtifactGraph.load(cur)
+    return graph
+
+#region Response cache
+## Encoded responses are reused until osc_dataset or a cluster table changes. The
+## data version is re-read at most once every RESPONSE_CACHE_VERSION_TTL seconds.
+response_cache = ResponseCache(
+    max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024)),
+)
+RESPONSE_CACHE_VERSION_TTL = float(os.getenv('RESPONSE_CACHE_VERSION_TTL', 1.0))
+data_version = None
+data_version_checked = float('-inf')
+data_version_lock = threading.Lock()
+
+def current_data_version():
+    ## (newest osc_dataset.updated_at, newest cluster build, published graph
+    ## snapshot); a change drops every cached response and reloads the artifact graph.
+    ## One request reads the version and rebuilds the graph outside the lock while
+    ## the others keep answering from the previous version and graph.
+    global data_version, data_version_checked, artifact_graph
+    if time.monotonic() - data_version_checked < RESPONSE_CACHE_VERSION_TTL:
+        return data_version
+    with data_version_lock:
+        if time.monotonic() - data_version_checked < RESPONSE_CACHE_VERSION_TTL:
+            return data_version
+        data_version_checked = time.monotonic()
+    try:
+        with get_db_cursor() as cur:
+            cur.execute("SELECT (SELECT max(updated_at) FROM osc_dataset), (SELECT max(built_at) FROM cluster_builds);")
+            version = tuple(str(value) for value in cur.fetchone())
+        if GRAPH_SNAPSHOT:
+            version += (str(graph_snapshot.snapshot_stamp(GRAPH_SNAPSHOT)),)
+        graph = None
+        if data_version is not None and version != data_version and artifact_graph is not None:
+            graph = load_artifact_graph()
+    except Exception as e:
+        ## Without a known version there is nothing to fall back to
+        if data_version is None:
+            raise
+        app.logger.warning("could not refresh the data version, keeping %s: %s", data_version, e)
+        return data_version
+    if version != data_version:
+        with data_version_lock:
+            if graph is not None:
+                artifact_graph = graph
+            if data_version is not None:
+                response_cache.clear()
+            data_version = version
+    return data_version
+
+#region Graph formats
+## Graph endpoints answer in plain JSON by default. `?format=compact|msgpack`, or
+## an Accept header naming the matching media type, selects the CompactGraph
+## encoding from graph_encoding.py instead.
+GRAPH_FORMATS = {"json": "application/json", "compact": COMPACT_MIMETYPE, "msgpack": MSGPACK_MIMETYPE}
+## Compact bodies smaller than this are not worth gzipping
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', 1024))
+
+def negotiate_graph_format():
+    ## The requested format name, or None for an unknown ?format=
+    if 'format' in request.args:
+        fmt = request.args['format']
+        return fmt if fmt in GRAPH_FORMATS else None
+    ## application/json first, so */* keeps the plain format
+    best = request.accept_mimetypes.best_match(list(GRAPH_FORMATS.values()), default="application/json")
+    return next(fmt for fmt, mimetype in GRAPH_FORMATS.items() if mimetype == best)
+
+def graph_response(verbose, compact):
+    ## verbose() builds the plain JSON payload and compact() the CompactGraph;
+    ## only the one for the negotiated format is built
+    fmt = negotiate_graph_format()
+    if fmt is None:
+        return jsonify({"error": "Invalid format. Must be 'json', 'compact' or 'msgpack'"}), 400
+    if fmt == "msgpack" and graph_encoding.msgpack is None:
+        return jsonify({"error": "msgpack is not installed on the server"}), 406
+    with span("graph"):
+        payload = verbose() if fmt == "json" else compact()
+    with span("serialize"):
+        if fmt == "json":
+            response = jsonify(payload)
+        elif fmt == "compact":
+            response = Response(json.dumps(payload.to_dict(), separators=(",", ":")), mimetype=COMPACT_MIMETYPE)
+        else:
+            response = Response(payload.encode_msgpack(), mimetype=MSGPACK_MIMETYPE)
+    response.vary.add('Accept')
+    return response
+
+@app.after_request
+def compress_graph_response(response):
+    ## Gzips compact graph bodies for clients that accept it. The ETag becomes weak
+    ## so If-None-Match still matches the cached identity body.
+    if (response.mimetype not in (COMPACT_MIMETYPE, MSGPACK_MIMETYPE)
+            or response.status_code != 200
+            or response.is_streamed
+            or 'gzip' not in request.accept_encodings
+            or response.content_length < GZIP_MIN_BYTES):
+        return response
+    with span("serialize"):
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+#endregion
+
+def cached_response(view):
+    ## Serves the view's encoded body from response_cache with an ETag, so an
+    ## If-None-Match revalidation is answered with an empty 304
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            version = current_data_version()
+        except Exception as e:
+            return {"error": str(e)}, 500
+        key = (request.full_path, negotiate_graph_format())
+        entry = response_cache.get(key, version)
+        if entry is None:
+            result = view(*args, **kwargs)
+            with span("serialize"):
+                response = app.make_response(result)
+            if response.status_code != 200:
+                return response
+            entry = response_cache.put(key, version, response.get_data(), response.mimetype)
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        response.vary.add('Accept')
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
+#endregion
+
 @app.route('/manifest/<specific_artifact_id>/', methods=['GET'])
+@cached_response
 def manifest(specific_artifact_id):
-    try:            
-        with get_db_cursor() as cur:            
-            cur.execute("SELECT artifact_id, data FROM osc_dataset")
-            records = cur.fetchall()
-            
-            result = []
-            hash_and_files = defaultdict(set)
-            hash_to_artifacts = defaultdict(set)
-            edges = defaultdict(set)
-            for artifact_id, data in records:
-                hashes = []         
-                manifest = data.get("public_fields", {}).get("manifest", {})
-                title = data.get("mandatory_public_fields",{}).get("title", "No Title")
-
-                for item in manifest:
-                    hashes.append(item.get("hash")) 
-                    hash_and_files[item.get("hash")].add(item.get("filename"))
-                    hash = item.get("hash")
-                    hash_to_artifacts[hash].add(artifact_id)
-                hash_and_files_serializable = {k: list(v) for k, v in hash_and_files.items()}
-                
-                result.append({
-                    "artifact_id": artifact_id,
-                    "title": title,
-                    "hashes": hashes,
-                    "hash_and_files": hash_and_files_serializable
-                })
-            
-            for h, artifact_ids in hash_to_artifacts.items():
-                if len(artifact_ids) > 1:
-                    for artifact_id in artifact_ids:
-                        edges[h].add(artifact_id)
-            
-            final_edges = []
-            
-            for h, artifact_ids in edges.items():
-                for node1, node2 in itertools.combinations(artifact_ids, 2):
-                    final_edges.append({
-                        "node1": node1,
-                        "node2": node2,
-                        "hash": h
-                    })
-            
-            # Convert defaultdict to a regular dict for JSON serialization
+    try:
+        graph = get_artifact_graph()
+        ## edges=all keeps the old one-edge-per-shared-hash form
+        aggregate = request.args.get('edges') != 'all'
+        return graph_response(
+            lambda: {"manifest": graph.manifest(specific_artifact_id, aggregate)},
+            lambda: graph.compact_manifest(specific_artifact_id, aggregate),
+        )
 
-            
-            specific_nodes = set()
-            if specific_artifact_id != "all":
-                filtered_edges = []
-                specific_nodes = set()
-                for edge in final_edges:
-                    if edge["node1"] == specific_artifact_id or edge["node2"] == specific_artifact_id:
-                        filtered_edges.append(edge)
-                        specific_nodes.add(edge["node1"])
-                        specific_nodes.add(edge["node2"])
-                final_edges = filtered_edges
-
-                if len(final_edges) > 0:
-                    result = [node for node in result if node["artifact_id"] in specific_nodes]
-                else:
-                    result = [node for node in result if node["artifact_id"] == specific_artifact_id]
-            result.append(
-            {
-                "edges": final_edges
-            }
-            )
-            return {"manifest": result}
-    
     except Exception as e:
         return {"error": str(e)}, 500
 #endregion
+
+#region Streaming export
+EXPORT_PAGE_LIMIT = int(os.getenv('EXPORT_PAGE_LIMIT', 100000))
+
+def export_rows(cursor, limit):
+    ## Yields ("node", row) for every artifact after the cursor position, then
+    ## ("edge", row) from hash_edges, stopping after `limit` rows with
+    ## ("cursor", token) so the next page resumes exactly there (None at the end).
+    phase, *position = cursor or ["nodes", 0]
+    remaining = limit
+    if phase == "nodes":
+        last_id = position[0]
+        with get_db_named_cursor("manifest_export_nodes") as cur:
+            cur.execute("""
+                SELECT d.id, d.artifact_id, d.data->'mandatory_public_fields'->>'title',
+                    (SELECT json_agg(json_build_array(m.hash, m.filename) ORDER BY m.position)
+                     FROM manifest_entries m WHERE m.artifact_id = d.artifact_id)
+                FROM osc_dataset d
+                WHERE d.id > %s
+                ORDER BY d.id
+                LIMIT %s;
+            """, (last_id, remaining))
+            for last_id, artifact_id, title, entries in cur:
+                remaining -= 1
+                yield "node", (artifact_id, title, entries or [])
+        if remaining == 0:
+            yield "cursor", encode_cursor(["nodes", last_id])
+            return
+        position = []
+
+    last_edge = position or ["", "", ""]
+    with get_db_named_cursor("manifest_export_edges") as cur:
+        cur.execute("""
+            SELECT node1, node2, hash FROM hash_edges
+            WHERE (node1, node2, hash) > (%s, %s, %s)
+            ORDER BY node1, node2, hash
+            LIMIT %s;
+        """, (*last_edge, remaining))
+        for last_edge in cur:
+            remaining -= 1
+            yield "edge", last_edge
+    yield "cursor", encode_cursor(["edges", *last_edge]) if remaining == 0 else None
+
+def export_node(artifact_id, title, entries):
+    hash_and_files = defaultdict(list)
+    for h, filename in entries:
+        hash_and_files[h].append(filename)
+    return {
+        "artifact_id": artifact_id,
+        "title": "No Title" if title is None else title,
+        "hashes": list(hash_and_files),
+        "hash_and_files": hash_and_files,
+    }
+
+def export_ndjson(rows, compact):
+    ## One JSON value per line: node objects, edges (objects, or [node1, node2, hash]
+    ## when compact) and a closing {"type": "end", "next_cursor": ...}
+    for kind, row in rows:
+        if kind == "node":
+            yield json.dumps({"type": "node", **export_node(*row)}) + "\n"
+        elif kind == "edge":
+            edge = list(row) if compact else {"type": "edge", "node1": row[0], "node2": row[1], "hash": row[2]}
+            yield json.dumps(edge) + "\n"
+        else:
+            yield json.dumps({"type": "end", "next_cursor": row}) + "\n"
+
+def export_json(rows, compact):
+    ## A single {"nodes": [...], "edges": [...], "next_cursor": ...} document written as it is read
+    yield '{"nodes": ['
+    separator = ""
+    in_edges = False
+    for kind, row in rows:
+        if kind != "node" and not in_edges:
+            yield '], "edges": ['
+            separator = ""
+            in_edges = True
+        if kind == "node":
+            yield separator + json.dumps(export_node(*row))
+        elif kind == "edge":
+            yield separator + json.dumps(list(row) if compact else {"node1": row[0], "node2": row[1], "hash": row[2]})
+        else:
+            yield '], "next_cursor": ' + json.dumps(row) + '}'
+        separator = ", "
+
+## Streams the full graph without building it in memory. Nodes come first, then
+## hash edges. `limit` rows per page (at most EXPORT_PAGE_LIMIT); pass the returned
+## next_cursor back as `cursor` for the next page. format=ndjson (default) or json;
+## edges=compact sends edges as [node1, node2, hash].
+@app.route('/manifest/all/stream', methods=['GET'])
+def export_manifest():
+    output = request.args.get('format', 'ndjson')
+    if output not in ('ndjson', 'json'):
+        return jsonify({"error": "Invalid format. Must be 'ndjson' or 'json'"}), 400
+    compact = request.args.get('edges') == 'compact'
+    limit = max(1, min(request.args.get('limit', EXPORT_PAGE_LIMIT, type=int), EXPORT_PAGE_LIMIT))
+    try:
+        cursor = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    ## ["nodes", last id] or ["edges", node1, node2, hash]; checked here because
+    ## once streaming starts an error can only cut the response short
+    if cursor is not None and not (cursor_matches(cursor, str, int) and cursor[0] == "nodes"
+                                   or cursor_matches(cursor, str, str, str, str) and cursor[0] == "edges"):
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    rows = export_rows(cursor, limit)
+    if output == 'ndjson':
+        return Response(export_ndjson(rows, compact), mimetype='application/x-ndjson')
+    return Response(export_json(rows, compact), mimetype='application/json')
+#endregion
 ## Getting specific artifact data
+def artifact_payload(artifact_id, data):
+    hash_and_files = defaultdict(set)
+    for item in data.get("public_fields", {}).get("manifest", {}) or []:
+        hash_and_files[item.get("hash")].add(item.get("filename"))
+    return {
+        "artifact_id": artifact_id,
+        "title": data.get("mandatory_public_fields", {}).get("title", "No Title"),
+        "keywords": data.get("public_fields", {}).get("keywords", []),
+        "manifest": {k: list(v) for k, v in hash_and_files.items()},
+        "doi": data.get("public_fields", {}).get("doi", {}),
+        "contributor": data.get("public_fields", {}).get("contributor", "No Contributor"),
+    }
+
 @app.route('/artifact/<artifact_id>/', methods=['GET'])
+@cached_response
 def get_artifact(artifact_id):
     try:
         with get_db_cursor() as cur:        
             cur.execute("SELECT data FROM osc_dataset WHERE artifact_id = %s;", (artifact_id,))
             row = cur.fetchone()
-            data = row[0]
-            hash_and_files = defaultdict(set)
-
-            manifest = data.get("public_fields", {}).get("manifest", {})
-
-            for item in manifest:
-                hash_and_files[item.get("hash")].add(item.get("filename"))
-                hash_and_files_serializable = {k: list(v) for k, v in hash_and_files.items()}
-            
-            
-            return {
-                "artifact_id": artifact_id,
-                "title": data.get("mandatory_public_fields", {}).get("title", "No Title"),
-                "keywords": data.get("public_fields", {}).get("keywords", []),
-                "manifest": hash_and_files_serializable,
-                "doi": data.get("public_fields", {}).get("doi", {}),
-                "contributor": data.get("public_fields", {}).get("contributor", "No Contributor"),
-                    }
+            return artifact_payload(artifact_id, row[0])
             
     except Exception as e:
         return {"error": str(e)}, 500
     
 
+#region Paging
+def encode_cursor(values):
+    ## Opaque continuation token for keyset paging
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(token):
+    return json.loads(base64.urlsafe_b64decode(token.encode()))
+
+def cursor_matches(cursor, *types):
+    ## Whether a decoded cursor is a list holding one value of each of `types`
+    return (isinstance(cursor, list) and len(cursor) == len(types)
+            and all(isinstance(value, kind) for value, kind in zip(cursor, types)))
+#endregion
+
+## Contributor names with their artifact counts, read from contributor_summary,
+## ordered by `sort` (name, the default, or count: most artifacts first). Without
+## `limit` every contributor is returned. With `limit` one page is returned plus
+## a `next_cursor` to pass back as `cursor` for the following page.
 @app.route('/cluster/contributor', methods=['GET'])
+@cached_response
 def get_contributor_cluster_names():
+    limit = request.args.get('limit', type=int)
+    sort = request.args.get('sort', 'name')
+    if sort not in ('count', 'name'):
+        return jsonify({"error": "Invalid sort. Must be 'count' or 'name'"}), 400
+
     with get_db_cursor() as cur:
-        cur.execute("SELECT contributor FROM contributor_index;")
-        
-        data = cur.fetchall()
-        contributor_names = [contributor[0] for contributor in data]
-        contributor_data = []
-        for contributor in contributor_names:
-            cur.execute("SELECT artifact_ids FROM contributor_index WHERE TRIM(contributor) ILIKE %s", (contributor.strip(),))
-            data = cur.fetchall()
-            row = [i[0] for i in data]
-            artifacts = [a.strip() for a in row[0].split(',')] if row and row[0] else []
-            contributor_data.append({"contributor": contributor, "num_artifacts": len(artifacts)})
+        if limit is None:
+            order = "num_artifacts DESC, contributor DESC" if sort == 'count' else "contributor"
+            cur.execute(f"SELECT contributor, num_artifacts FROM contributor_summary ORDER BY {order};")
+            rows = cur.fetchall()
+            return {"contributors": [{"contributor": row[0], "num_artifacts": row[1]} for row in rows]}
+
+        limit = max(1, min(limit, 1000))
+        try:
+            cursor = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        ## [num_artifacts, contributor] of the last row of the previous page
+        if cursor is not None and not cursor_matches(cursor, int, str):
+            return jsonify({"error": "Invalid cursor"}), 400
+        if sort == 'count':
+            if cursor:
+                cur.execute("""
+                    SELECT contributor, num_artifacts FROM contributor_summary
+                    WHERE (num_artifacts, contributor) < (%s, %s)
+                    ORDER BY num_artifacts DESC, contributor DESC LIMIT %s;
+                """, (cursor[0], cursor[1], limit))
+            else:
+                cur.execute("""
+                    SELECT contributor, num_artifacts FROM contributor_summary
+                    ORDER BY num_artifacts DESC, contributor DESC LIMIT %s;
+                """, (limit,))
+        else:
+            cur.execute("""
+                SELECT contributor, num_artifacts FROM contributor_summary
+                WHERE contributor > %s
+                ORDER BY contributor LIMIT %s;
+            """, (cursor[1] if cursor else '', limit))
+        rows = cur.fetchall()
+
+    next_cursor = encode_cursor([rows[-1][1], rows[-1][0]]) if len(rows) == limit else None
+    return {
+        "contributors": [{"contributor": row[0], "num_artifacts": row[1]} for row in rows],
+        "next_cursor": next_cursor,
+    }
+
+#region Group clusters
+## Artifacts sharing a contributor (or a keyword, or a hash) are all linked to
+## each other: a group of n members is a clique of n*(n-1)/2 edges. Group
+## responses send each such clique once and leave any expansion to the client.
+## `?form=` picks the shape:
+##   group  {"groups": [{"type": ..., "key": ..., "members": [artifact_id, ...]}]}
+##   star   one hub node per group linked to each member, n edges per group:
+##          {"nodes": [{"id": hub, "type": ..., "key": ..., "size": n}],
+##           "edges": [{"node1": hub, "node2": artifact_id, "type": ...}]}
+##   edges  every member pair, the old all-pairs form
+## In the compact formats a group is a run of node indices in "groups"
+## "members", split by "member_offsets" like the multi-key edge columns.
+GROUP_FORMS = ("group", "star", "edges")
+## kind -> (cluster table, name column, (key, artifact_id) table, key column)
+GROUP_KINDS = {
+    "hash": ("hash_clusters", "cluster_hashes", "hash_artifacts", "hash"),
+    "keyword": ("keyword_clusters", "cluster_name", "keyword_artifacts", "keyword"),
+}
+
+def group_hub(group_type, key):
+    return f"{group_type}:{key}"
+
+def group_pairs(members):
+    ## The all-pairs edges of one group; a lone member is sent as a bare node
+    if len(members) == 1:
+        return [{"node1": members[0]}]
+    return [{"node1": a, "node2": b} for a, b in combinations(members, 2)]
+
+def group_payload(groups, form):
+    ## groups are (type, key, members) tuples
+    if form == "group":
+        return {"groups": [{"type": group_type, "key": key, "members": members} for group_type, key, members in groups]}
+    if form == "star":
+        return {
+            "nodes": [
+                {"id": group_hub(group_type, key), "type": group_type, "key": key, "size": len(members)}
+                for group_type, key, members in groups
+            ],
+            "edges": [
+                {"node1": group_hub(group_type, key), "node2": member, "type": group_type}
+                for group_type, key, members in groups for member in members
+            ],
+        }
+    return {"edges": [edge for _, _, members in groups for edge in group_pairs(members)]}
+
+def group_graph(groups, form):
+    graph = CompactGraph()
+    if form == "group":
+        members = []
+        offsets = [0]
+        for _, _, group_members in groups:
+            members.extend(graph.node(member) for member in group_members)
+            offsets.append(len(members))
+        graph.extra["groups"] = {
+            "type": [group_type for group_type, _, _ in groups],
+            "key": [graph.key(key) for _, key, _ in groups],
+            "members": members,
+            "member_offsets": offsets,
+        }
+    elif form == "star":
+        for group_type, key, group_members in groups:
+            graph.node(group_hub(group_type, key))
+            for member in group_members:
+                graph.add_edge(group_hub(group_type, key), member, key)
+        hubs = {group_hub(group_type, key) for group_type, key, _ in groups}
+        graph.node_data["hub"] = [node in hubs for node in graph.nodes]
+    else:
+        for _, key, group_members in groups:
+            for node1, node2 in combinations(group_members, 2):
+                graph.add_edge(node1, node2, key)
+    return graph
 
-        return {"contributors": contributor_data}
+def group_response(groups):
+    form = request.args.get('form', 'group')
+    if form not in GROUP_FORMS:
+        return jsonify({"error": "Invalid form. Must be 'group', 'star' or 'edges'"}), 400
+    return graph_response(lambda: group_payload(groups, form), lambda: group_graph(groups, form))
 
+def group_cluster_response(kind, cluster_name):
+    ## A hash or keyword cluster as one group per key it shares
+    table, name_column, key_table, key_column = GROUP_KINDS[kind]
+    with get_db_cursor() as cur:
+        cur.execute(f"""
+            SELECT k.{key_column}, array_agg(k.artifact_id ORDER BY k.artifact_id)
+            FROM (
+                SELECT DISTINCT unnest(string_to_array({name_column}, ',')) AS key
+                FROM {table} WHERE {name_column} = %s
+            ) shared
+            JOIN {key_table} k ON k.{key_column} = shared.key
+            GROUP BY k.{key_column}
+            HAVING count(*) > 1
+            ORDER BY k.{key_column};
+        """, (cluster_name,))
+        groups = [(kind, key, members) for key, members in cur.fetchall()]
+    return group_response(groups)
+
+## The artifacts of one contributor as a single group. Names match after trimming
+## and case folding, through contributor_artifacts_normalized_idx.
 @app.route('/cluster/contributor/<path:contributor>', methods=['GET'])
 def get_contributor_cluster_values(contributor):
     with get_db_cursor() as cur:
-        cur.execute( "SELECT artifact_ids FROM contributor_index WHERE TRIM(contributor) ILIKE %s",
-            (contributor.strip(),))
-
-        data = cur.fetchall()
-        row = [i[0] for i in data]
-        artifacts = [a.strip() for a in row[0].split(',')] if row and row[0] else []
-        if(len(artifacts) > 1):
-            edges = [
-                {"node1": a, "node2": b}
-                for a, b in combinations(artifacts, 2)
-            ]
-        else:
-            edges = [{"node1": artifacts[0]}]
+        cur.execute("""
+            SELECT contributor, artifact_id FROM contributor_artifacts
+            WHERE lower(btrim(contributor)) = lower(btrim(%s))
+            ORDER BY artifact_id;
+        """, (contributor,))
+        rows = cur.fetchall()
 
-        return {"edges": edges}
+    groups = [("contributor", min(row[0] for row in rows), [row[1] for row in rows])] if rows else []
+    return group_response(groups)
+#endregion
 
 ## Keyword Clustering
 @app.route('/cluster/keywords', methods=['GET'])
+@cached_response
 def get_keyword_cluster_names():
     with get_db_cursor() as cur:
-        cur.execute("SELECT cluster_name, jsonb_array_length(edges::jsonb) AS edge_count FROM keyword_clusters;")
+        cur.execute("SELECT cluster_name, edge_count FROM keyword_clusters;")
         keywords = cur.fetchall()
         keyword_data = [{"cluster_name": kw[0], "edge_count": kw[1]} for kw in keywords]
 
@@ -189,20 +733,30 @@ def get_keyword_cluster_names():
 
         return {"keywords" : keyword_data}
 
+## Plain JSON keeps the original shape: "edges" holds each matching cluster's
+## edge list as a JSON string
 @app.route('/cluster/keywords/<path:cluster_name>', methods=['GET'])
 def get_keyword_cluster_values(cluster_name):
+    if 'budget' in request.args:
+        return lod_cluster_response("keyword", cluster_name)
+    if request.args.get('form', 'edges') != 'edges':
+        return group_cluster_response("keyword", cluster_name)
     with get_db_cursor() as cur:
         cur.execute("SELECT edges FROM keyword_clusters WHERE cluster_name=%s;",(cluster_name,))
         data = cur.fetchall()
         edges = [i[0] for i in data]
 
 
-        return {"edges": edges}
+        return graph_response(
+            lambda: {"edges": [json.dumps(cluster_edges) for cluster_edges in edges]},
+            lambda: CompactGraph.from_edges((edge for cluster_edges in edges for edge in cluster_edges), "shared", True, "weight"),
+        )
 
 @app.route('/cluster/hashes/', methods=["GET"])
+@cached_response
 def get_hash_cluster_names():
     with get_db_cursor() as cur:
-        cur.execute("SELECT cluster_hashes, jsonb_array_length(edges::jsonb) AS edge_count FROM hash_clusters;")
+        cur.execute("SELECT cluster_hashes, edge_count FROM hash_clusters;")
         clusters = cur.fetchall()
         cluster_data = [{"cluster_name": i[0], "edge_count": i[1]} for i in clusters]
     
@@ -210,68 +764,173 @@ def get_hash_cluster_names():
 
 @app.route('/cluster/hashes/<path:cluster_name>', methods=['GET'])
 def get_hash_cluster_values(cluster_name):
+    if 'budget' in request.args:
+        return lod_cluster_response("hash", cluster_name)
+    if request.args.get('form', 'edges') != 'edges':
+        return group_cluster_response("hash", cluster_name)
     with get_db_cursor() as cur:
         cur.execute("SELECT edges FROM hash_clusters WHERE cluster_hashes=%s;",(cluster_name,))
         data = cur.fetchall()
         edges = [i[0] for i in data]
 
-    return {"edges": edges}
+    return graph_response(
+        lambda: {"edges": [json.dumps(cluster_edges) for cluster_edges in edges]},
+        lambda: CompactGraph.from_edges((edge for cluster_edges in edges for edge in cluster_edges), "shared", True, "weight"),
+    )
+
+#region Level of detail
+## Cluster detail routes take ?budget=N to return the cluster coarsened to at
+## most N nodes, from the hierarchy init_clusters.py stores in cluster_lod_nodes
+## and cluster_lod_edges. Super-nodes carry the number of artifacts inside them
+## and are opened one at a time with /cluster/lod/<kind>/<node>.
+LOD_KINDS = {"hash": ("hash_clusters", "cluster_hashes"), "keyword": ("keyword_clusters", "cluster_name")}
+
+def lod_graph(nodes, edges):
+    ## nodes are (node, level, size) rows, edges (node1, node2, weight) rows
+    graph = CompactGraph()
+    for node, _, _ in nodes:
+        graph.node(node)
+    graph.node_data["level"] = [level for _, level, _ in nodes]
+    graph.node_data["size"] = [size for _, _, size in nodes]
+    weights = graph.column("weight")
+    for node1, node2, weight in edges:
+        graph.add_edge(node1, node2)
+        weights.append(weight)
+    return graph
+
+def lod_response(nodes, edges, **extra):
+    def compact():
+        graph = lod_graph(nodes, edges)
+        graph.extra.update(extra)
+        return graph
+
+    return graph_response(lambda: {
+        "nodes": [{"node": node, "level": level, "size": size} for node, level, size in nodes],
+        "edges": [{"node1": node1, "node2": node2, "weight": weight} for node1, node2, weight in edges],
+        **extra,
+    }, compact)
+
+def lod_cluster_response(kind, cluster_name):
+    ## Picks the finest level at which the cluster's components together have at
+    ## most `budget` nodes; a budget below the number of components gets the roots
+    budget = request.args.get('budget', type=int)
+    if budget is None or budget < 1:
+        return jsonify({"error": "budget must be a positive integer"}), 400
+    table, name_column = LOD_KINDS[kind]
+    with get_db_cursor() as cur:
+        cur.execute(f"SELECT component FROM {table} WHERE {name_column} = %s AND component IS NOT NULL;", (cluster_name,))
+        components = sorted({component for (component,) in cur.fetchall()})
+        if not components:
+            return jsonify({"error": "No level-of-detail data for this cluster"}), 404
+        cur.execute("""
+            SELECT component, level, count(*) FROM cluster_lod_nodes
+            WHERE kind = %s AND component = ANY(%s) GROUP BY component, level;
+        """, (kind, components))
+        counts = defaultdict(dict)
+        for component, level, count in cur.fetchall():
+            counts[component][level] = count
+        if not counts:
+            return jsonify({"error": "No level-of-detail data for this cluster"}), 404
+
+        top = {component: max(levels) for component, levels in counts.items()}
+        level = max(top.values())
+        for candidate in range(level + 1):
+            if sum(levels[min(candidate, top[component])] for component, levels in counts.items()) <= budget:
+                level = candidate
+                break
+        chosen = [(component, min(level, top[component])) for component in counts]
+
+        cur.execute("""
+            SELECT n.node, n.level, n.size FROM cluster_lod_nodes n
+            JOIN unnest(%s::text[], %s::int[]) AS c(component, level) ON n.component = c.component AND n.level = c.level
+            WHERE n.kind = %s ORDER BY n.size DESC, n.node;
+        """, ([c for c, _ in chosen], [l for _, l in chosen], kind))
+        nodes = cur.fetchall()
+        cur.execute("""
+            SELECT e.node1, e.node2, e.weight FROM cluster_lod_edges e
+            JOIN unnest(%s::text[], %s::int[]) AS c(component, level) ON e.component = c.component AND e.level = c.level
+            WHERE e.kind = %s ORDER BY e.node1, e.node2;
+        """, ([c for c, _ in chosen], [l for _, l in chosen], kind))
+        edges = cur.fetchall()
+    return lod_response(nodes, edges, budget=budget, level=level)
+
+@app.route('/cluster/lod/<kind>/<path:node>', methods=['GET'])
+def expand_lod_node(kind, node):
+    ## The members of one super-node one level down and the edges among them.
+    ## "boundary" edges link a member to the super-node, at the expanded node's
+    ## level, that holds the other end of an edge leaving the expanded node.
+    if kind not in LOD_KINDS:
+        return jsonify({"error": "Invalid kind. Must be 'hash' or 'keyword'"}), 400
+    with get_db_cursor() as cur:
+        cur.execute("SELECT component, level FROM cluster_lod_nodes WHERE kind = %s AND node = %s;", (kind, node))
+        row = cur.fetchone()
+        if row is None:
+            return jsonify({"error": "Node not found"}), 404
+        component, level = row
+        if level == 0:
+            return jsonify({"error": "Artifacts cannot be expanded"}), 400
+
+        cur.execute("""
+            SELECT node, level, size FROM cluster_lod_nodes
+            WHERE kind = %s AND component = %s AND level = %s AND parent = %s ORDER BY size DESC, node;
+        """, (kind, component, level - 1, node))
+        nodes = cur.fetchall()
+        members = [member for member, _, _ in nodes]
+        cur.execute("""
+            SELECT node1, node2, weight FROM cluster_lod_edges
+            WHERE kind = %s AND component = %s AND level = %s AND (node1 = ANY(%s) OR node2 = ANY(%s))
+            ORDER BY node1, node2;
+        """, (kind, component, level - 1, members, members))
+        inside = set(members)
+        edges = []
+        leaving = []
+        for node1, node2, weight in cur.fetchall():
+            if node1 in inside and node2 in inside:
+                edges.append((node1, node2, weight))
+            else:
+                leaving.append((node1, node2, weight) if node1 in inside else (node2, node1, weight))
+
+        cur.execute("""
+            SELECT node, parent FROM cluster_lod_nodes
+            WHERE kind = %s AND component = %s AND level = %s AND node = ANY(%s);
+        """, (kind, component, level - 1, sorted({other for _, other, _ in leaving})))
+        parent_of = dict(cur.fetchall())
+    boundary = defaultdict(int)
+    for member, other, weight in leaving:
+        boundary[(member, parent_of[other])] += weight
+    return lod_response(nodes, edges, node=node, level=level - 1, boundary=[
+        {"node1": member, "node2": other, "weight": weight} for (member, other), weight in sorted(boundary.items())
+    ])
+#endregion
 
 ## Getting the artifacts that have same keywords
+## Defaults and hard limits for the keyword traversal; callers may lower them with query parameters
+KEYWORD_MAX_DEPTH = int(os.getenv('KEYWORD_MAX_DEPTH', 5))
+KEYWORD_MAX_NODES = int(os.getenv('KEYWORD_MAX_NODES', 2000))
+KEYWORD_MAX_EDGES = int(os.getenv('KEYWORD_MAX_EDGES', 10000))
+
 @app.route('/artifact/keywords/<artifact_id>/', methods=['GET'])
 def get_all_artifacts_w_keywords(artifact_id):
-    with get_db_cursor as cur:
-        seen_edges = set()
-        edge_list = []
-        depth = 5
-        recurse_keywords(cur, artifact_id, edge_list, seen_edges, depth, depth_counter=0)
+    depth = request.args.get('depth', KEYWORD_MAX_DEPTH, type=int)
+    max_nodes = request.args.get('max_nodes', KEYWORD_MAX_NODES, type=int)
+    max_edges = request.args.get('max_edges', KEYWORD_MAX_EDGES, type=int)
+    if depth < 0 or max_nodes < 1 or max_edges < 1:
+        return jsonify({"error": "depth must be at least 0, max_nodes and max_edges at least 1"}), 400
+    depth = min(depth, KEYWORD_MAX_DEPTH)
+    max_nodes = min(max_nodes, KEYWORD_MAX_NODES)
+    max_edges = min(max_edges, KEYWORD_MAX_EDGES)
+    graph = get_artifact_graph()
+    with span("graph"):
+        edge_list, truncated = graph.keyword_neighbourhood(artifact_id, depth, max_nodes, max_edges)
 
-    return jsonify({"edge_list":edge_list})
+    def compact():
+        graph = CompactGraph.from_edges(edge_list, "shared_keywords", multi=True, weight_field="weight")
+        graph.edges["node1depth"] = [edge["node1depth"] for edge in edge_list]
+        graph.edges["node2depth"] = [edge["node2depth"] for edge in edge_list]
+        graph.extra["truncated"] = truncated
+        return graph
 
-def recurse_keywords(cur, artifact_id, edges, seen_edges, max_depth, depth_counter):
-    ## Checks if visited the artifact_id already
-    if depth_counter >= max_depth:
-        return
-    
-    ## Checking the nodes that are immediately connected with the keyword
-    common_artifacts = find_artifacts_with_shared_keywords(cur, artifact_id)
-    if len(common_artifacts) == 0:
-        return
-    
-    ## If there was a repeat edge it continues to loop through. 
-    for artifact in common_artifacts:
-        edge_key = tuple(sorted([artifact_id, artifact]))
-        if edge_key in seen_edges:
-            continue
-        edges.append({"node1": artifact_id, "node2": artifact, "shared_keywords": common_artifacts[artifact], "node1depth": depth_counter,"node2depth": depth_counter+1})
-        seen_edges.add(edge_key)
-        recurse_keywords(cur, artifact, edges, seen_edges, max_depth, depth_counter + 1)
-
-def find_artifacts_with_shared_keywords(cur, artifact_id):
-    ## query returns the artifacts that share the keyword along with the keyword that they share
-    cur.execute("""
-        WITH artifact_keywords AS (
-            SELECT TRIM(keyword) AS keyword
-            FROM keyword_index,
-                unnest(string_to_array(artifact_ids, ',')) AS aid
-            WHERE aid = %s
-        )
-        SELECT
-            aid2 AS shared_artifact_id,
-            TRIM(ki.keyword) AS shared_keyword
-        FROM keyword_index ki
-        JOIN LATERAL unnest(string_to_array(ki.artifact_ids, ',')) AS aid2 ON TRUE
-        JOIN artifact_keywords ak ON TRIM(ki.keyword) = ak.keyword
-        WHERE aid2 != %s;
-    """, (artifact_id, artifact_id))
-
-
-    rows = cur.fetchall()
-    shared = defaultdict(list)
-    for artifact, keyword in rows:
-        shared[artifact].append(keyword)
-    ## Returns the artifact and keyword that is shared    
-    return shared
+    return graph_response(lambda: {"edge_list": edge_list, "truncated": truncated}, compact)
     
     
 @app.route('/artifact/contributor/<artifact_id>/', methods=['GET'])
@@ -285,14 +944,14 @@ def get_all_artifacts_w_contributor(artifact_id):
     return jsonify({"edge_list": edge_list})
 
 def find_artifact_with_shared_contributor(cur, artifact_id):
-    cur.execute(f"SELECT contributor FROM contributor_index where artifact_ids LIKE '%{artifact_id}%';")
+    cur.execute("SELECT contributor FROM contributor_artifacts WHERE artifact_id = %s;", (artifact_id,))
     contributor = cur.fetchone()
+    if contributor is None:
+        return [], None
     contributor = contributor[0]
     
-    cur.execute("SELECT artifact_ids FROM contributor_index WHERE contributor = %s;", (contributor,))
-    row = cur.fetchone()
-    artifact_ids = row[0].split(',') if row and row[0] else []
-    artifact_ids.remove(artifact_id)
+    cur.execute("SELECT artifact_id FROM contributor_artifacts WHERE contributor = %s AND artifact_id != %s;", (contributor, artifact_id))
+    artifact_ids = [row[0] for row in cur.fetchall()]
     
     return artifact_ids, contributor
 
@@ -325,17 +984,22 @@ def get_edge_data(node1, node2, edge_type):
     
     with get_db_cursor() as cur:
         if edge_type == 'contributor':
-            cur.execute("SELECT contributor FROM contributor_index WHERE artifact_ids LIKE %s;", (f"%{node1}%",))
+            cur.execute("""
+                SELECT a.contributor FROM contributor_artifacts a
+                JOIN contributor_artifacts b ON b.contributor = a.contributor
+                WHERE a.artifact_id = %s AND b.artifact_id = %s;
+            """, (node1, node2))
             row = cur.fetchone()
             if row:
                 return jsonify({"contributor": row[0]})
             else:
-                return jsonify
+                return jsonify({"error": "No contributor found"}), 404
         elif edge_type == 'keyword':
             cur.execute("""
-                SELECT keyword FROM keyword_index
-                WHERE artifact_ids LIKE %s AND artifact_ids LIKE %s;
-            """, (f"%{node1}%", f"%{node2}%"))
+                SELECT a.keyword FROM keyword_artifacts a
+                JOIN keyword_artifacts b ON b.keyword = a.keyword
+                WHERE a.artifact_id = %s AND b.artifact_id = %s;
+            """, (node1, node2))
             row = cur.fetchall()
             ##flatten row
             row = [i[0] for i in row]
@@ -347,9 +1011,10 @@ def get_edge_data(node1, node2, edge_type):
 
         elif edge_type == 'hash':
             cur.execute("""
-                SELECT hash FROM hash_index
-                WHERE artifact_ids LIKE %s AND artifact_ids LIKE %s;
-            """, (f"%{node1}%", f"%{node2}%"))
+                SELECT a.hash FROM hash_artifacts a
+                JOIN hash_artifacts b ON b.hash = a.hash
+                WHERE a.artifact_id = %s AND b.artifact_id = %s;
+            """, (node1, node2))
             row = cur.fetchall()
             row = [i[0] for i in row]
             
@@ -364,13 +1029,7 @@ def get_filehash_data(hash_value):
     try:
         with get_db_cursor() as cur:
         
-            cur.execute("""
-            SELECT 
-            m->>'filename' AS filename
-            FROM osc_dataset,
-            jsonb_array_elements(data->'public_fields'->'manifest') AS m
-            WHERE m->>'hash' = %s;
-            """, (hash_value,))
+            cur.execute("SELECT filename FROM manifest_entries WHERE hash = %s LIMIT 1;", (hash_value,))
             
             records = cur.fetchone()
 
@@ -380,5 +1039,425 @@ def get_filehash_data(hash_value):
     
     except Exception as e:
         return {"error": str(e)}, 500
+
+#region Search
+## Ranked search over osc_dataset.ts_vector (title, description and keywords,
+## kept by trigger_osc_dataset_ts) through the osc_dataset_ts_idx GIN index.
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 100))
+## Neighbours listed per relation for every search result
+SEARCH_MAX_NEIGHBOURS = int(os.getenv('SEARCH_MAX_NEIGHBOURS', 50))
+
+def search_tsquery(text):
+    ## "graph visual" -> "graph:* & visual:*": every word must match, as a prefix
+    return " & ".join(f"{word}:*" for word in re.findall(r"\w+", text.lower()))
+
+def search_neighbours(graph, artifact_ids, contributor_neighbours):
+    ## {artifact_id: {"hash": [...], "keyword": [...], "contributor": [...]}} where
+    ## each list holds {"artifact_id", "title", "shared"}, most shared first
+    def listing(shared):
+        ranked = sorted(shared.items(), key=lambda item: (-len(item[1]), item[0]))
+        return [
+            {"artifact_id": other, "title": graph.titles[graph.index[other]] if other in graph.index else "No Title", "shared": keys}
+            for other, keys in ranked[:SEARCH_MAX_NEIGHBOURS]
+        ]
+
+    neighbours = {}
+    for artifact_id in artifact_ids:
+        entry = neighbours[artifact_id] = {}
+        artifact = graph.index.get(artifact_id)
+        for kind in ("hash", "keyword"):
+            relation = graph.relations[kind]
+            shared = {} if artifact is None else relation.neighbours(artifact)
+            entry[kind] = listing({
+                graph.artifact_ids[other]: [relation.keys[k] for k in keys]
+                for other, keys in shared.items()
+            })
+        entry["contributor"] = listing(contributor_neighbours.get(artifact_id, {}))
+    return neighbours
+
+## Artifacts matching `q` (every word as a prefix) and/or carrying every `keyword`
+## given, best ts_rank first. Pages of `limit` results continue with `cursor`.
+## Each result lists its hash, keyword and contributor neighbours unless
+## neighbours=0.
+@app.route('/search', methods=['GET'])
+def search():
+    query = search_tsquery(request.args.get('q', ''))
+    keywords = [keyword.strip() for keyword in request.args.getlist('keyword') if keyword.strip()]
+    if not query and not keywords:
+        return jsonify({"error": "Expected a 'q' search text or a 'keyword'"}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), SEARCH_MAX_LIMIT))
+    with_neighbours = request.args.get('neighbours', '1') != '0'
+    try:
+        cursor = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    ## [rank, id] of the last result of the previous page
+    if cursor is not None and not cursor_matches(cursor, (int, float), int):
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    conditions = []
+    params = []
+    if query:
+        rank = "ts_rank(d.ts_vector, to_tsquery(%s))"
+        params.append(query)
+        conditions.append("d.ts_vector @@ to_tsquery(%s)")
+        params.append(query)
+    else:
+        rank = "0"
+    if keywords:
+        conditions.append("""d.artifact_id IN (
+            SELECT artifact_id FROM keyword_artifacts WHERE keyword = ANY(%s)
+            GROUP BY artifact_id HAVING count(*) = %s)""")
+        params.extend([keywords, len(set(keywords))])
+    page = ""
+    if cursor is not None:
+        page = "WHERE rank < %s OR (rank = %s AND id > %s)"
+        params.extend([cursor[0], cursor[0], cursor[1]])
+
+    with get_db_cursor() as cur:
+        cur.execute(f"""
+            SELECT id, artifact_id, title, rank FROM (
+                SELECT d.id, d.artifact_id, d.data->'mandatory_public_fields'->>'title' AS title, {rank}::float8 AS rank
+                FROM osc_dataset d
+                WHERE {" AND ".join(conditions)}
+            ) matches
+            {page}
+            ORDER BY rank DESC, id
+            LIMIT %s;
+        """, (*params, limit + 1))
+        rows = cur.fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        contributor_neighbours = defaultdict(dict)
+        if with_neighbours and rows:
+            cur.execute("""
+                SELECT a.artifact_id, b.artifact_id, a.contributor FROM contributor_artifacts a
+                JOIN contributor_artifacts b ON b.contributor = a.contributor AND b.artifact_id != a.artifact_id
+                WHERE a.artifact_id = ANY(%s);
+            """, ([row[1] for row in rows],))
+            for artifact_id, other, contributor in cur.fetchall():
+                contributor_neighbours[artifact_id].setdefault(other, []).append(contributor)
+
+    results = [
+        {"artifact_id": artifact_id, "title": "No Title" if title is None else title, "rank": rank}
+        for _, artifact_id, title, rank in rows
+    ]
+    if with_neighbours:
+        neighbours = search_neighbours(get_artifact_graph(), [row[1] for row in rows], contributor_neighbours)
+        for result in results:
+            result["neighbours"] = neighbours[result["artifact_id"]]
+    next_cursor = encode_cursor([rows[-1][3], rows[-1][0]]) if more else None
+    return jsonify({"results": results, "next_cursor": next_cursor})
+#endregion
+
+#region Similarity
+## Near-duplicate artifacts by the Jaccard similarity of their manifest hash
+## sets, found through the MinHash/LSH index of similarity.py (needs NumPy).
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.5))
+SIMILAR_MAX_LIMIT = int(os.getenv('SIMILAR_MAX_LIMIT', 500))
+similarity_index = None
+similarity_lock = threading.Lock()
+
+def get_similarity_index():
+    ## (graph, index) built from the current artifact graph; rebuilt whenever the graph is
+    global similarity_index
+    graph = get_artifact_graph()
+    current = similarity_index
+    if current is None or current[0] is not graph:
+        with similarity_lock:
+            if similarity_index is None or similarity_index[0] is not graph:
+                with span("graph"):
+                    similarity_index = (graph, MinHashIndex.from_relation(graph.relations["hash"]))
+            current = similarity_index
+    return current
+
+def similarity_threshold():
+    threshold = request.args.get('threshold', SIMILARITY_THRESHOLD, type=float)
+    return threshold if 0 < threshold <= 1 else None
+
+## Artifacts whose hash sets overlap the given artifact's by at least `threshold`
+## (Jaccard), most similar first
+@app.route('/similar/<artifact_id>/', methods=['GET'])
+def get_similar_artifacts(artifact_id):
+    if MinHashIndex is None:
+        return jsonify({"error": "Similarity search needs numpy on the server"}), 501
+    threshold = similarity_threshold()
+    if threshold is None:
+        return jsonify({"error": "threshold must be in (0, 1]"}), 400
+    limit = max(1, min(request.args.get('limit', 50, type=int), SIMILAR_MAX_LIMIT))
+    graph, index = get_similarity_index()
+    artifact = graph.index.get(artifact_id)
+    if artifact is None:
+        return jsonify({"error": "Artifact not found"}), 404
+
+    similar = [
+        {"artifact_id": graph.artifact_ids[other], "title": graph.titles[other], "jaccard": jaccard}
+        for other, jaccard in index.similar(artifact, threshold)[:limit]
+    ]
+    return jsonify({"artifact_id": artifact_id, "threshold": threshold, "similar": similar})
+
+## One Jaccard-weighted edge per artifact pair at or above `threshold`, instead
+## of one edge per shared hash
+@app.route('/similar/edges/', methods=['GET'])
+@cached_response
+def get_similarity_edges():
+    if MinHashIndex is None:
+        return jsonify({"error": "Similarity search needs numpy on the server"}), 501
+    threshold = similarity_threshold()
+    if threshold is None:
+        return jsonify({"error": "threshold must be in (0, 1]"}), 400
+    graph, index = get_similarity_index()
+    ids = graph.artifact_ids
+    edges = [
+        {"node1": ids[a], "node2": ids[b], "jaccard": jaccard}
+        for a, b, jaccard in sorted(index.pairs(threshold), key=lambda pair: (-pair[2], pair[0], pair[1]))
+    ]
+    return jsonify({"threshold": threshold, "edges": edges})
+#endregion
+
+#region Batch lookups
+## POST variants of /artifact, /filehash and /edge that resolve a whole list in
+## one query and return a map keyed by the requested values. Ids that do not
+## exist are left out of the map.
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 5000))
+
+def batch_items(field, item_type=str):
+    ## The JSON body's `field` list, or a 400 response tuple when it is missing,
+    ## too long or holds anything other than `item_type` items
+    body = request.get_json(silent=True) or {}
+    items = body.get(field)
+    if not isinstance(items, list):
+        return None, (jsonify({"error": f"Expected a JSON body with a '{field}' list"}), 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, (jsonify({"error": f"At most {BATCH_MAX_ITEMS} {field} per request"}), 400)
+    if not all(isinstance(item, item_type) for item in items):
+        kind = "strings" if item_type is str else "objects"
+        return None, (jsonify({"error": f"'{field}' must be a list of {kind}"}), 400)
+    return items, None
+
+## {"ids": [...]} -> {"artifacts": {artifact_id: <same object as /artifact/<id>/>}}
+@app.route('/artifacts', methods=['POST'])
+def get_artifacts():
+    ids, error = batch_items("ids")
+    if error:
+        return error
+    with get_db_cursor() as cur:
+        cur.execute("SELECT artifact_id, data FROM osc_dataset WHERE artifact_id = ANY(%s);", (ids,))
+        artifacts = {artifact_id: artifact_payload(artifact_id, data) for artifact_id, data in cur.fetchall()}
+    return jsonify({"artifacts": artifacts})
+
+## {"hashes": [...]} -> {"filenames": {hash: filename}}
+@app.route('/filehashes', methods=['POST'])
+def get_filehashes():
+    hashes, error = batch_items("hashes")
+    if error:
+        return error
+    with get_db_cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT ON (hash) hash, filename FROM manifest_entries
+            WHERE hash = ANY(%s)
+            ORDER BY hash, artifact_id, position;
+        """, (hashes,))
+        filenames = dict(cur.fetchall())
+    return jsonify({"filenames": filenames})
+
+## {"edges": [{"node1": ..., "node2": ..., "type": "hash" | "keyword" | "contributor"}, ...]}
+## -> {"edges": {type: {node1: {node2: value}}}} where value is the list of
+## shared hashes or keywords, or the shared contributor, as in /edge/<node1>/<node2>/<type>
+@app.route('/edges', methods=['POST'])
+def get_edges():
+    requested, error = batch_items("edges", dict)
+    if error:
+        return error
+    pairs = {edge_type: ([], []) for edge_type in ('hash', 'keyword', 'contributor')}
+    seen = set()
+    for edge in requested:
+        if (edge.get("type") not in pairs
+                or not isinstance(edge.get("node1"), str)
+                or not isinstance(edge.get("node2"), str)):
+            return jsonify({"error": "Each edge needs node1, node2 and a type of 'hash', 'keyword', or 'contributor'"}), 400
+        key = (edge["type"], edge.get("node1"), edge.get("node2"))
+        if key not in seen:
+            seen.add(key)
+            pairs[edge["type"]][0].append(edge.get("node1"))
+            pairs[edge["type"]][1].append(edge.get("node2"))
+
+    with get_db_cursor() as cur:
+        cur.execute("""
+            SELECT 'hash', p.node1, p.node2, a.hash
+            FROM unnest(%s::text[], %s::text[]) AS p(node1, node2)
+            JOIN hash_artifacts a ON a.artifact_id = p.node1
+            JOIN hash_artifacts b ON b.hash = a.hash AND b.artifact_id = p.node2
+            UNION ALL
+            SELECT 'keyword', p.node1, p.node2, a.keyword
+            FROM unnest(%s::text[], %s::text[]) AS p(node1, node2)
+            JOIN keyword_artifacts a ON a.artifact_id = p.node1
+            JOIN keyword_artifacts b ON b.keyword = a.keyword AND b.artifact_id = p.node2
+            UNION ALL
+            SELECT 'contributor', p.node1, p.node2, a.contributor
+            FROM unnest(%s::text[], %s::text[]) AS p(node1, node2)
+            JOIN contributor_artifacts a ON a.artifact_id = p.node1
+            JOIN contributor_artifacts b ON b.contributor = a.contributor AND b.artifact_id = p.node2;
+        """, (*pairs['hash'], *pairs['keyword'], *pairs['contributor']))
+        rows = cur.fetchall()
+
+    edges = defaultdict(lambda: defaultdict(dict))
+    for edge_type, node1, node2, value in rows:
+        if edge_type == 'contributor':
+            edges[edge_type][node1].setdefault(node2, value)
+        else:
+            edges[edge_type][node1].setdefault(node2, []).append(value)
+    return jsonify({"edges": edges})
+#endregion
+
+#region Neighbourhood
+## Everything the artifact view needs in one request: the artifact itself and
+## its hash, keyword and contributor neighbours up to `depth` hops, walked on the
+## resident artifact graph (ArtifactGraph.neighbourhood). Query parameters:
+##   relations  comma separated subset of hash,keyword,contributor (default all)
+##   depth      hops from the artifact (default 1)
+##   fanout     neighbours followed per expanded artifact, most shared keys first
+##   limit      artifacts per page
+##   cursor     next_cursor of the previous page
+## Artifacts come in visiting order with their depth; an edge is sent on the page
+## of its later visited end, so each page only references artifacts already sent.
+## The walk is capped at NEIGHBOURHOOD_MAX_NODES artifacts and NEIGHBOURHOOD_MAX_EDGES
+## edges, and `truncated` says a cap left neighbours out. The first page also carries "artifact", the
+## /artifact/<id>/ object. A cursor is bound to the graph version and the walk
+## parameters; reusing one after either changed is a 409.
+NEIGHBOURHOOD_RELATIONS = ("hash", "keyword", "contributor")
+NEIGHBOURHOOD_MAX_DEPTH = int(os.getenv('NEIGHBOURHOOD_MAX_DEPTH', 3))
+NEIGHBOURHOOD_FANOUT = int(os.getenv('NEIGHBOURHOOD_FANOUT', 50))
+NEIGHBOURHOOD_MAX_FANOUT = int(os.getenv('NEIGHBOURHOOD_MAX_FANOUT', 200))
+NEIGHBOURHOOD_MAX_NODES = int(os.getenv('NEIGHBOURHOOD_MAX_NODES', 5000))
+NEIGHBOURHOOD_MAX_EDGES = int(os.getenv('NEIGHBOURHOOD_MAX_EDGES', 20000))
+NEIGHBOURHOOD_PAGE_LIMIT = int(os.getenv('NEIGHBOURHOOD_PAGE_LIMIT', 500))
+
+@app.route('/neighbourhood/<artifact_id>/', methods=['GET'])
+@cached_response
+def get_neighbourhood(artifact_id):
+    relations = request.args.get('relations', ",".join(NEIGHBOURHOOD_RELATIONS)).split(",")
+    if any(relation not in NEIGHBOURHOOD_RELATIONS for relation in relations):
+        return jsonify({"error": "Invalid relations. Must be a comma separated list of 'hash', 'keyword' or 'contributor'"}), 400
+    relations = list(dict.fromkeys(relations))
+    depth = max(0, min(request.args.get('depth', 1, type=int), NEIGHBOURHOOD_MAX_DEPTH))
+    fanout = max(1, min(request.args.get('fanout', NEIGHBOURHOOD_FANOUT, type=int), NEIGHBOURHOOD_MAX_FANOUT))
+    limit = max(1, min(request.args.get('limit', NEIGHBOURHOOD_PAGE_LIMIT, type=int), NEIGHBOURHOOD_PAGE_LIMIT))
+    try:
+        cursor = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    ## Pages of one walk share this tag; the walk is only reproducible while it holds
+    walk = json.dumps([current_data_version(), relations, depth, fanout])
+    tag = hashlib.sha1(walk.encode()).hexdigest()[:16]
+    offset = 0
+    if cursor is not None:
+        if not (isinstance(cursor, list) and len(cursor) == 2 and isinstance(cursor[0], int) and cursor[0] > 0):
+            return jsonify({"error": "Invalid cursor"}), 400
+        if cursor[1] != tag:
+            return jsonify({"error": "The graph or the walk parameters changed since this cursor was issued; start again without a cursor"}), 409
+        offset = cursor[0]
+
+    artifact = None
+    if offset == 0:
+        with get_db_cursor() as cur:
+            cur.execute("SELECT data FROM osc_dataset WHERE artifact_id = %s;", (artifact_id,))
+            row = cur.fetchone()
+        if row is None:
+            return jsonify({"error": "Artifact not found"}), 404
+        artifact = artifact_payload(artifact_id, row[0])
+
+    graph = get_artifact_graph()
+    with span("graph"):
+        walked = graph.neighbourhood(artifact_id, relations, depth, fanout, NEIGHBOURHOOD_MAX_NODES, NEIGHBOURHOOD_MAX_EDGES)
+    ## An artifact newer than the loaded graph has no neighbours yet
+    nodes, edges, truncated = walked or ([], [], False)
+    page_nodes = nodes[offset:offset + limit]
+    positions = [edge[0] for edge in edges]
+    page_edges = edges[bisect_left(positions, offset):bisect_left(positions, offset + limit)]
+    next_cursor = encode_cursor([offset + limit, tag]) if offset + limit < len(nodes) else None
+
+    ids = graph.artifact_ids
+    hashes = graph.relations["hash"]
+
+    def shared(kind, keys):
+        keys_of = graph.relations[kind].keys
+        return [keys_of[k] for k in keys[:EDGE_SAMPLE]]
+
+    def verbose():
+        payload = {
+            "nodes": [
+                {"artifact_id": ids[node], "title": graph.titles[node], "depth": node_depth,
+                 "num_hashes": len(hashes.keys_of(node))}
+                for node, node_depth in page_nodes
+            ],
+            "edges": [
+                {"node1": ids[a], "node2": ids[b], "type": kind, "weight": len(keys), "shared": shared(kind, keys)}
+                for _, a, b, kind, keys in page_edges
+            ],
+            "truncated": truncated,
+            "next_cursor": next_cursor,
+        }
+        if artifact is not None:
+            payload["artifact"] = artifact
+        return payload
+
+    def compact():
+        ## The page's artifacts come first (extra "page_nodes" of them), followed by
+        ## artifacts of earlier pages that its edges lead back to
+        compact_graph = CompactGraph()
+        order = []
+        for node, _ in page_nodes:
+            compact_graph.node(ids[node])
+            order.append(node)
+        weights = compact_graph.column("weight")
+        types = compact_graph.column("type")
+        for _, a, b, kind, keys in page_edges:
+            for node in (a, b):
+                if ids[node] not in compact_graph.node_index:
+                    order.append(node)
+            compact_graph.add_edge(ids[a], ids[b], shared(kind, keys), multi=True)
+            weights.append(len(keys))
+            types.append(relations.index(kind))
+        depth_of = dict(nodes)
+        compact_graph.node_data["title"] = [graph.titles[node] for node in order]
+        compact_graph.node_data["depth"] = [depth_of[node] for node in order]
+        compact_graph.node_data["num_hashes"] = [len(hashes.keys_of(node)) for node in order]
+        compact_graph.extra["page_nodes"] = len(page_nodes)
+        compact_graph.extra["types"] = relations
+        compact_graph.extra["truncated"] = truncated
+        compact_graph.extra["next_cursor"] = next_cursor
+        if artifact is not None:
+            compact_graph.extra["artifact"] = artifact
+        return compact_graph
+
+    return graph_response(verbose, compact)
+#endregion
+
+
+## Development: `python manifest_backend.py` (Flask's reloader-free dev server).
+## Production: `python manifest_backend.py --production` serves through waitress
+## with one thread per pooled connection. Any WSGI server can also load
+## `manifest_backend:app`, e.g. `gunicorn -w 4 --threads 10 manifest_backend:app`.
+def main():
+    parser = argparse.ArgumentParser(description="Serve the manifest backend.")
+    parser.add_argument("--host", default=os.getenv('BACKEND_HOST', '127.0.0.1'))
+    parser.add_argument("--port", type=int, default=int(os.getenv('BACKEND_PORT', 5000)))
+    parser.add_argument("--production", action="store_true", help="serve with waitress instead of the Flask dev server")
+    parser.add_argument("--threads", type=int, default=DB_POOL_MAX, help="worker threads in production mode")
+    args = parser.parse_args()
+
+    get_artifact_graph()
+    if not args.production:
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("--production needs waitress: pip install waitress")
+    serve(app, host=args.host, port=args.port, threads=args.threads)
+
 if __name__ == '__main__':
-    app.run(port=5000)
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,50 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+CachedResponse = namedtuple("CachedResponse", ["version", "body", "mimetype", "etag"])
+
+
+## LRU cache of already-encoded response bodies, bounded by entry count and by
+## total body size. Every entry remembers the data version it was built from and
+## is ignored once the version moves on.
+class ResponseCache:
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.version != version:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body, mimetype):
+        etag = hashlib.sha1(body).hexdigest()
+        entry = CachedResponse(version, body, mimetype, etag)
+        if len(body) > self.max_bytes:
+            return entry
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        self.size -= len(self.entries.pop(key).body)
@@ -0,0 +1,130 @@
+import numpy as np
+
+## Universal hashing h(x) = (a * x + b) mod PRIME; a * x stays below 2^62
+PRIME = np.uint64((1 << 31) - 1)
+## Signature value of an artifact without keys; real values are always < PRIME
+EMPTY = np.uint32(0xFFFFFFFF)
+
+
+def minhash_signatures(offsets, tokens, a, b, chunk_tokens=1 << 16):
+    ## offsets/tokens are a CSR key set per artifact (tokens are integer key ids).
+    ## Returns the (artifacts, len(a)) uint32 MinHash matrix; artifacts are done a
+    ## chunk of about `chunk_tokens` keys at a time to bound the hash matrix size.
+    n = len(offsets) - 1
+    signatures = np.full((n, len(a)), EMPTY, dtype=np.uint32)
+    nonempty = offsets[1:] > offsets[:-1]
+    start = 0
+    while start < n:
+        end = int(np.searchsorted(offsets, offsets[start] + chunk_tokens, side="right")) - 1
+        end = min(max(end, start + 1), n)
+        lo, hi = offsets[start], offsets[end]
+        if hi > lo:
+            x = tokens[lo:hi].astype(np.uint64) % PRIME
+            hashed = (x[:, None] * a[None, :] + b[None, :]) % PRIME
+            chunk_nonempty = nonempty[start:end]
+            ## reduceat folds each artifact's run of rows; empty artifacts have no run
+            segment_starts = (offsets[start:end] - lo)[chunk_nonempty]
+            signatures[start:end][chunk_nonempty] = np.minimum.reduceat(hashed, segment_starts, axis=0)
+        start = end
+    return signatures
+
+
+## MinHash signatures of every artifact's key set (file hashes) indexed with LSH
+## banding: the signature is cut into `bands` bands of `rows` values, and two
+## artifacts become candidates when any band is identical. Each band is kept as
+## a sorted array of band keys, so a lookup is a binary search per band rather
+## than a scan of all artifacts. Candidates are verified with the exact Jaccard
+## similarity of their key sets. Pairs well below (1 / bands) ** (1 / rows)
+## similarity are rarely candidates, so lower thresholds are approximate.
+class MinHashIndex:
+    def __init__(self, offsets, tokens, num_perm=128, bands=32, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.tokens = np.asarray(tokens, dtype=np.int64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(PRIME), num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(PRIME), num_perm, dtype=np.uint64)
+        self.band_multipliers = rng.integers(1, 1 << 63, self.rows, dtype=np.uint64) | np.uint64(1)
+
+        signatures = minhash_signatures(self.offsets, self.tokens, self.a, self.b)
+        ## Artifacts without keys are not indexed (they would all share one bucket)
+        self.members = np.flatnonzero(self.offsets[1:] > self.offsets[:-1]).astype(np.int32)
+        band_keys = self.band_keys(signatures[self.members])
+        self.order = np.argsort(band_keys, axis=1, kind="stable").astype(np.int32)
+        self.sorted_keys = np.take_along_axis(band_keys, self.order, axis=1)
+
+    @classmethod
+    def from_relation(cls, relation, **kwargs):
+        ## Indexes an artifact_graph.Relation (e.g. the graph's "hash" relation)
+        return cls(np.array(relation.artifact_offsets, dtype=np.int64),
+                   np.array(relation.artifact_keys, dtype=np.int64), **kwargs)
+
+    def band_keys(self, signatures):
+        ## (bands, artifacts) uint64 key of each signature band; the multiply-add
+        ## wraps around modulo 2^64, which is fine for bucketing
+        n = len(signatures)
+        banded = signatures.reshape(n, self.bands, self.rows).astype(np.uint64)
+        return (banded * self.band_multipliers).sum(axis=2, dtype=np.uint64).T
+
+    def keys_of(self, artifact):
+        return self.tokens[self.offsets[artifact]:self.offsets[artifact + 1]]
+
+    def jaccard(self, keys, other):
+        other_keys = self.keys_of(other)
+        shared = len(np.intersect1d(keys, other_keys, assume_unique=True))
+        return shared / (len(keys) + len(other_keys) - shared)
+
+    def candidates(self, keys):
+        ## Indexed artifacts sharing at least one band with the key set
+        if len(keys) == 0:
+            return np.empty(0, dtype=np.int32)
+        signature = minhash_signatures(np.array([0, len(keys)], dtype=np.int64), keys, self.a, self.b)
+        found = []
+        for band, key in enumerate(self.band_keys(signature)[:, 0]):
+            lo = np.searchsorted(self.sorted_keys[band], key, side="left")
+            hi = np.searchsorted(self.sorted_keys[band], key, side="right")
+            if hi > lo:
+                found.append(self.order[band, lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return self.members[np.unique(np.concatenate(found))]
+
+    def similar(self, artifact, threshold):
+        ## [(other artifact, jaccard)] with jaccard >= threshold, most similar first
+        keys = np.unique(self.keys_of(artifact))
+        results = []
+        for other in self.candidates(keys):
+            if other == artifact:
+                continue
+            similarity = self.jaccard(keys, other)
+            if similarity >= threshold:
+                results.append((int(other), similarity))
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results
+
+    def pairs(self, threshold):
+        ## Yields every (a, b, jaccard) with a < b and jaccard >= threshold among
+        ## the pairs that share a band bucket
+        seen = set()
+        for band in range(self.bands):
+            keys = self.sorted_keys[band]
+            boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [len(keys)]))
+            for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+                bucket = np.sort(self.members[self.order[band, start:end]])
+                for i, a in enumerate(bucket):
+                    keys_a = None
+                    for b in bucket[i + 1:]:
+                        pair = (int(a), int(b))
+                        if pair in seen:
+                            continue
+                        seen.add(pair)
+                        if keys_a is None:
+                            keys_a = np.unique(self.keys_of(a))
+                        similarity = self.jaccard(keys_a, b)
+                        if similarity >= threshold:
+                            yield pair[0], pair[1], similarity
@@ -0,0 +1,71 @@
+--
+-- Normalized (key, artifact_id) association tables replacing the comma-joined
+-- artifact_ids strings of keyword_index, hash_index and contributor_index.
+-- The primary key serves lookups by key, the second B-tree lookups by artifact.
+--
+-- Run once against an existing database:
+--   psql -d osc_portal -f sql/migrations/01_artifact_index_tables.sql
+-- Afterwards `python init_clusters.py --index-tables` rebuilds them from osc_dataset.
+--
+
+CREATE TABLE IF NOT EXISTS public.keyword_artifacts (
+    keyword text NOT NULL,
+    artifact_id character varying(52) NOT NULL,
+    PRIMARY KEY (keyword, artifact_id)
+);
+
+CREATE INDEX IF NOT EXISTS keyword_artifacts_artifact_id_idx ON public.keyword_artifacts USING btree (artifact_id);
+
+
+CREATE TABLE IF NOT EXISTS public.hash_artifacts (
+    hash text NOT NULL,
+    artifact_id character varying(52) NOT NULL,
+    PRIMARY KEY (hash, artifact_id)
+);
+
+CREATE INDEX IF NOT EXISTS hash_artifacts_artifact_id_idx ON public.hash_artifacts USING btree (artifact_id);
+
+
+CREATE TABLE IF NOT EXISTS public.contributor_artifacts (
+    contributor text NOT NULL,
+    artifact_id character varying(52) NOT NULL,
+    PRIMARY KEY (contributor, artifact_id)
+);
+
+CREATE INDEX IF NOT EXISTS contributor_artifacts_artifact_id_idx ON public.contributor_artifacts USING btree (artifact_id);
+
+
+--
+-- Carry over what the old index tables hold. hash_index rows may be '{a,b}' array literals.
+--
+
+DO $$
+BEGIN
+    IF to_regclass('public.keyword_index') IS NOT NULL THEN
+        INSERT INTO public.keyword_artifacts (keyword, artifact_id)
+        SELECT DISTINCT TRIM(keyword), TRIM(aid)
+        FROM public.keyword_index,
+            unnest(string_to_array(btrim(artifact_ids, '{}'), ',')) AS aid
+        WHERE TRIM(aid) <> '' AND TRIM(keyword) <> ''
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    IF to_regclass('public.hash_index') IS NOT NULL THEN
+        INSERT INTO public.hash_artifacts (hash, artifact_id)
+        SELECT DISTINCT TRIM(hash), TRIM(aid)
+        FROM public.hash_index,
+            unnest(string_to_array(btrim(artifact_ids, '{}'), ',')) AS aid
+        WHERE TRIM(aid) <> '' AND TRIM(hash) <> ''
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    IF to_regclass('public.contributor_index') IS NOT NULL THEN
+        INSERT INTO public.contributor_artifacts (contributor, artifact_id)
+        SELECT DISTINCT TRIM(contributor), TRIM(aid)
+        FROM public.contributor_index,
+            unnest(string_to_array(btrim(artifact_ids, '{}'), ',')) AS aid
+        WHERE TRIM(aid) <> '' AND TRIM(contributor) <> ''
+        ON CONFLICT DO NOTHING;
+    END IF;
+END
+$$;
@@ -0,0 +1,81 @@
+--
+-- Precomputed manifest entries of osc_dataset, so hash lookups never parse the
+-- data->'public_fields'->'manifest' JSONB at request time.
+--
+-- manifest_entries is kept in step by trigger_osc_dataset_manifest. The
+-- hash_edges materialized view (one row per artifact pair per shared hash) is
+-- refreshed explicitly with
+--   REFRESH MATERIALIZED VIEW CONCURRENTLY public.hash_edges;
+-- or `python init_clusters.py --refresh-edges`.
+--
+
+CREATE TABLE IF NOT EXISTS public.manifest_entries (
+    artifact_id character varying(52) NOT NULL,
+    "position" integer NOT NULL,
+    hash text NOT NULL,
+    filename text
+);
+
+CREATE INDEX IF NOT EXISTS manifest_entries_hash_idx ON public.manifest_entries USING btree (hash);
+CREATE INDEX IF NOT EXISTS manifest_entries_artifact_id_idx ON public.manifest_entries USING btree (artifact_id, "position");
+
+
+--
+-- Name: osc_dataset_manifest_changes(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION public.osc_dataset_manifest_changes() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+   manifest jsonb;
+BEGIN
+   IF TG_OP <> 'INSERT' THEN
+      DELETE FROM public.manifest_entries WHERE artifact_id = OLD.artifact_id;
+   END IF;
+   IF TG_OP = 'DELETE' THEN
+      RETURN OLD;
+   END IF;
+
+   manifest := NEW.data#>'{public_fields,manifest}';
+   IF jsonb_typeof(manifest) = 'array' THEN
+      INSERT INTO public.manifest_entries (artifact_id, "position", hash, filename)
+      SELECT NEW.artifact_id, m.position, m.entry->>'hash', m.entry->>'filename'
+      FROM jsonb_array_elements(manifest) WITH ORDINALITY AS m(entry, position)
+      WHERE m.entry->>'hash' IS NOT NULL;
+   END IF;
+   RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trigger_osc_dataset_manifest ON public.osc_dataset;
+CREATE TRIGGER trigger_osc_dataset_manifest AFTER INSERT OR DELETE OR UPDATE OF artifact_id, data ON public.osc_dataset FOR EACH ROW EXECUTE FUNCTION public.osc_dataset_manifest_changes();
+
+
+--
+-- Backfill from the rows already in osc_dataset.
+--
+
+DELETE FROM public.manifest_entries;
+INSERT INTO public.manifest_entries (artifact_id, "position", hash, filename)
+SELECT d.artifact_id, m.position, m.entry->>'hash', m.entry->>'filename'
+FROM public.osc_dataset d,
+    jsonb_array_elements(d.data#>'{public_fields,manifest}') WITH ORDINALITY AS m(entry, position)
+WHERE jsonb_typeof(d.data#>'{public_fields,manifest}') = 'array' AND m.entry->>'hash' IS NOT NULL;
+
+
+--
+-- Name: hash_edges; Type: MATERIALIZED VIEW; Schema: public; Owner: -
+--
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.hash_edges AS
+    WITH artifact_hashes AS (
+        SELECT DISTINCT artifact_id, hash FROM public.manifest_entries
+    )
+    SELECT a.artifact_id AS node1, b.artifact_id AS node2, a.hash
+    FROM artifact_hashes a
+    JOIN artifact_hashes b ON b.hash = a.hash AND b.artifact_id > a.artifact_id;
+
+-- The unique index is what allows REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS hash_edges_pair_idx ON public.hash_edges USING btree (node1, node2, hash);
+CREATE INDEX IF NOT EXISTS hash_edges_node2_idx ON public.hash_edges USING btree (node2);
@@ -0,0 +1,11 @@
+--
+-- What the backend watches to tell whether cached responses are still current:
+-- max(osc_dataset.updated_at) for ingests and cluster_builds for cluster table rebuilds.
+--
+
+CREATE INDEX IF NOT EXISTS osc_dataset_updated_at_idx ON public.osc_dataset USING btree (updated_at);
+
+CREATE TABLE IF NOT EXISTS public.cluster_builds (
+    kind text PRIMARY KEY,
+    built_at timestamp without time zone DEFAULT now() NOT NULL
+);
@@ -0,0 +1,46 @@
+--
+-- Per-contributor artifact counts kept in step with contributor_artifacts, so
+-- /cluster/contributor reads names and counts with one index scan.
+--
+
+CREATE TABLE IF NOT EXISTS public.contributor_summary (
+    contributor text PRIMARY KEY,
+    num_artifacts integer NOT NULL
+);
+
+-- Serves "top contributors" pages: ORDER BY num_artifacts DESC, contributor DESC
+CREATE INDEX IF NOT EXISTS contributor_summary_count_idx ON public.contributor_summary USING btree (num_artifacts, contributor);
+
+
+--
+-- Name: contributor_artifacts_changes(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION public.contributor_artifacts_changes() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+   IF TG_OP = 'INSERT' THEN
+      INSERT INTO public.contributor_summary (contributor, num_artifacts)
+      VALUES (NEW.contributor, 1)
+      ON CONFLICT (contributor) DO UPDATE SET num_artifacts = contributor_summary.num_artifacts + 1;
+      RETURN NEW;
+   END IF;
+
+   UPDATE public.contributor_summary SET num_artifacts = num_artifacts - 1 WHERE contributor = OLD.contributor;
+   DELETE FROM public.contributor_summary WHERE contributor = OLD.contributor AND num_artifacts <= 0;
+   RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trigger_contributor_artifacts_summary ON public.contributor_artifacts;
+CREATE TRIGGER trigger_contributor_artifacts_summary AFTER INSERT OR DELETE ON public.contributor_artifacts FOR EACH ROW EXECUTE FUNCTION public.contributor_artifacts_changes();
+
+
+--
+-- Backfill from the rows already in contributor_artifacts.
+--
+
+DELETE FROM public.contributor_summary;
+INSERT INTO public.contributor_summary (contributor, num_artifacts)
+SELECT contributor, count(*) FROM public.contributor_artifacts GROUP BY contributor;
@@ -0,0 +1,24 @@
+--
+-- Cluster edge lists stored as jsonb instead of JSON text, with the edge count
+-- kept as a generated column, so /cluster/keywords and /cluster/hashes list
+-- clusters without re-parsing every edges document.
+--
+
+CREATE TABLE IF NOT EXISTS public.hash_clusters (
+    cluster_hashes text,
+    edges jsonb
+);
+
+CREATE TABLE IF NOT EXISTS public.keyword_clusters (
+    cluster_name text,
+    edges jsonb
+);
+
+ALTER TABLE public.hash_clusters ALTER COLUMN edges TYPE jsonb USING edges::jsonb;
+ALTER TABLE public.keyword_clusters ALTER COLUMN edges TYPE jsonb USING edges::jsonb;
+
+ALTER TABLE public.hash_clusters ADD COLUMN IF NOT EXISTS edge_count integer GENERATED ALWAYS AS (jsonb_array_length(edges)) STORED;
+ALTER TABLE public.keyword_clusters ADD COLUMN IF NOT EXISTS edge_count integer GENERATED ALWAYS AS (jsonb_array_length(edges)) STORED;
+
+CREATE INDEX IF NOT EXISTS hash_clusters_cluster_hashes_idx ON public.hash_clusters USING btree (cluster_hashes);
+CREATE INDEX IF NOT EXISTS keyword_clusters_cluster_name_idx ON public.keyword_clusters USING btree (cluster_name);
@@ -0,0 +1,33 @@
+--
+-- Level-of-detail hierarchy of every cluster, computed by init_clusters.py next
+-- to the cluster rows (clustering.coarsen). Level 0 holds the artifacts; each
+-- level above groups the one below into super-nodes, up to a single root.
+-- `size` is the number of artifacts inside a node and `parent` its node one
+-- level up, so expanding a super-node is a lookup of its children.
+--
+
+CREATE TABLE IF NOT EXISTS public.cluster_lod_nodes (
+    kind text NOT NULL,
+    component character varying(52) NOT NULL,
+    level integer NOT NULL,
+    node text NOT NULL,
+    parent text,
+    size integer NOT NULL,
+    PRIMARY KEY (kind, component, level, node)
+);
+
+-- Children of a super-node: WHERE kind, component, level = parent level - 1, parent
+CREATE INDEX IF NOT EXISTS cluster_lod_nodes_parent_idx ON public.cluster_lod_nodes USING btree (kind, component, level, parent);
+
+CREATE TABLE IF NOT EXISTS public.cluster_lod_edges (
+    kind text NOT NULL,
+    component character varying(52) NOT NULL,
+    level integer NOT NULL,
+    node1 text NOT NULL,
+    node2 text NOT NULL,
+    weight integer NOT NULL,
+    PRIMARY KEY (kind, component, level, node1, node2)
+);
+
+-- Super-node names ("<level>:<smallest artifact id>") are unique within a kind
+CREATE INDEX IF NOT EXISTS cluster_lod_nodes_node_idx ON public.cluster_lod_nodes USING btree (kind, node);
@@ -0,0 +1,13 @@
+--
+-- Hash indexes for the cluster name lookups of /cluster/hashes/<name> and
+-- /cluster/keywords/<name>. A cluster name joins every hash or keyword the
+-- cluster shares, so on large corpora it outgrows the btree row limit
+-- (8191 bytes) and inserting the cluster fails; a hash index stores only
+-- a 4-byte hash of the name and serves the same equality lookups.
+--
+
+DROP INDEX IF EXISTS public.hash_clusters_cluster_hashes_idx;
+DROP INDEX IF EXISTS public.keyword_clusters_cluster_name_idx;
+
+CREATE INDEX IF NOT EXISTS hash_clusters_cluster_hashes_hash_idx ON public.hash_clusters USING hash (cluster_hashes);
+CREATE INDEX IF NOT EXISTS keyword_clusters_cluster_name_hash_idx ON public.keyword_clusters USING hash (cluster_name);
@@ -0,0 +1,7 @@
+--
+-- Index on the normalized contributor name, so /cluster/contributor/<name>
+-- matches a name regardless of case and surrounding whitespace with one index
+-- range scan, instead of testing TRIM(contributor) ILIKE on every row.
+--
+
+CREATE INDEX IF NOT EXISTS contributor_artifacts_normalized_idx ON public.contributor_artifacts USING btree (lower(btrim(contributor)), artifact_id);
@@ -0,0 +1,18 @@
+--
+-- osc_dataset.updated_at only had DEFAULT now(), and trigger_osc_dataset_ts
+-- sets ts_vector alone, so an edited row kept its insert time. Incremental
+-- cluster updates (init_clusters.update_clusters) and the backend's response
+-- cache both read max(updated_at) to find changes; bump it on every UPDATE.
+--
+
+CREATE OR REPLACE FUNCTION public.osc_dataset_touch_updated_at() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+   NEW.updated_at = now();
+   RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trigger_osc_dataset_updated_at ON public.osc_dataset;
+CREATE TRIGGER trigger_osc_dataset_updated_at BEFORE UPDATE ON public.osc_dataset FOR EACH ROW EXECUTE FUNCTION public.osc_dataset_touch_updated_at();
@@ -0,0 +1,30 @@
+--
+-- State of the incremental cluster maintenance in init_clusters.py
+-- (update_clusters). cluster_state is the persisted union-find: every
+-- artifact's keys and the root (smallest artifact_id) of the component it
+-- belongs to. cluster_sync holds each kind's updated_at watermark. The cluster
+-- tables record the component of each cluster row, which update_clusters
+-- rewrites per component and the level-of-detail routes look up.
+--
+
+CREATE TABLE IF NOT EXISTS public.cluster_state (
+    kind text NOT NULL,
+    artifact_id character varying(52) NOT NULL,
+    component character varying(52) NOT NULL,
+    keys text[] NOT NULL,
+    PRIMARY KEY (kind, artifact_id)
+);
+
+CREATE INDEX IF NOT EXISTS cluster_state_component_idx ON public.cluster_state USING btree (kind, component);
+CREATE INDEX IF NOT EXISTS cluster_state_keys_idx ON public.cluster_state USING gin (keys);
+
+CREATE TABLE IF NOT EXISTS public.cluster_sync (
+    kind text PRIMARY KEY,
+    last_run timestamp without time zone NOT NULL
+);
+
+ALTER TABLE public.hash_clusters ADD COLUMN IF NOT EXISTS component character varying(52);
+ALTER TABLE public.keyword_clusters ADD COLUMN IF NOT EXISTS component character varying(52);
+
+CREATE INDEX IF NOT EXISTS hash_clusters_component_idx ON public.hash_clusters USING btree (component);
+CREATE INDEX IF NOT EXISTS keyword_clusters_component_idx ON public.keyword_clusters USING btree (component);